@@ -11,9 +11,13 @@ class QuestionModel(BaseModel):
 
 class QuestionOutput(BaseModel):
     questions: conlist(QuestionModel,min_length=5, max_length=12) = Field(description="List of coding questions")
+
+class QuestionShardOutput(BaseModel):
+    questions: conlist(QuestionModel,min_length=1, max_length=12) = Field(description="List of coding questions")
     
 class State(TypedDict):
     messages: Annotated[List[AnyMessage], add_messages]
+    user_id: int
     programmingLanguage: Annotated[str, "accumulate"]  
     difficulty: Annotated[str, "accumulate"]  
     generated_questions: List[QuestionModel]
@@ -22,4 +26,6 @@ class State(TypedDict):
     duplicate_questions: List[QuestionModel]
     number_of_retries: int
     number_of_questions_to_generate: int
+    shards: int
+    questions_per_shard: int
     error: str
\ No newline at end of file
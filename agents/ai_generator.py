@@ -1,54 +1,169 @@
 from langchain_core.messages import  HumanMessage
 from langgraph.graph import  StateGraph, END
-from langchain_google_genai import ChatGoogleGenerativeAI
 from dotenv import load_dotenv
-from sqlalchemy.orm import Session
+from contextlib import aclosing
+from typing import Callable, Optional
+import asyncio
+import functools
+import os
+import time
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException, status
-from ..agents.agent_schemas import State
+from ..agents.agent_schemas import QuestionModel, State
+from ..agents.dedup_index import get_question_index
 from ..agents.node_1 import generate_questions_with_ai
 from ..agents.node_2 import router, uniqueness_validator
 from ..database.models import Challenge
+from ..metrics import generation_labels, metrics
 from ..routes.route_schemas import ChallengeRequest
+from ..tracing import traced
 
 
 
 load_dotenv()
 
 # client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash")
+
+NODE_SECONDS = metrics.histogram("question_graph_node_seconds", "Wall time per question graph node run", ("node", "language", "difficulty"))
+NODE_ERRORS = metrics.counter("question_graph_node_errors_total", "Question graph node runs that raised, returned nothing or reported an error", ("node", "reason", "language", "difficulty"))
+VALIDATED_QUESTIONS = metrics.counter("question_graph_questions_total", "Generated questions per validation result", ("result", "language", "difficulty"))
+ROUTER_DECISIONS = metrics.counter("question_graph_router_decisions_total", "Router decisions after a validation pass", ("decision", "language", "difficulty"))
+GENERATION_SECONDS = metrics.histogram("question_generation_seconds", "Wall time per question graph run", ("outcome", "language", "difficulty"))
+GENERATION_RETRIES = metrics.histogram("question_generation_retries", "Generation rounds after the first one per graph run", ("language", "difficulty"), buckets=(0, 1, 2, 3, 4))
+
+
+def state_labels(state: dict) -> dict:
+    return {"language": state.get("programmingLanguage") or "", "difficulty": state.get("difficulty") or ""}
+
+
+def count_validation(before: dict, result: dict, labels: dict):
+    VALIDATED_QUESTIONS.inc(len(result["accepted_questions"]) - before["accepted"], result="accepted", **labels)
+    VALIDATED_QUESTIONS.inc(len(result["duplicate_questions"]), result="duplicate", **labels)
+
+
+def instrument_node(name: str, node: Callable, after: Optional[Callable] = None):
+    """Times a node and counts its failures, nodes are left untouched while metrics are off"""
+    if not metrics.enabled:
+        return node
+
+    @functools.wraps(node)
+    async def measured(state):
+        labels = state_labels(state)
+        # Nodes swap accepted_questions for a new list, so the count is taken up front
+        before = {"accepted": len(state.get("accepted_questions") or [])}
+        # LLM calls made inside the node pick these up for their own labels
+        token = generation_labels.set(labels)
+        started = time.perf_counter()
+        try:
+            result = await node(state)
+        except Exception:
+            NODE_ERRORS.inc(node=name, reason="exception", **labels)
+            raise
+        finally:
+            generation_labels.reset(token)
+            NODE_SECONDS.observe(time.perf_counter() - started, node=name, **labels)
+
+        if result is None:
+            # Nodes print and swallow their exceptions
+            NODE_ERRORS.inc(node=name, reason="empty", **labels)
+        elif result.get("error"):
+            NODE_ERRORS.inc(node=name, reason="reported", **labels)
+        elif after is not None:
+            after(before, result, labels)
+        return result
+
+    return measured
+
+
+def instrument_router(route: Callable):
+    if not metrics.enabled:
+        return route
+
+    @functools.wraps(route)
+    def measured(state):
+        decision = route(state)
+        ROUTER_DECISIONS.inc(decision=decision, **state_labels(state))
+        return decision
+
+    return measured
+
+
+def record_generation(started: float, outcome: str, retries: int, programmingLanguage: str, difficulty: str):
+    if not metrics.enabled:
+        return
+    GENERATION_SECONDS.observe(time.perf_counter() - started, outcome=outcome, language=programmingLanguage, difficulty=difficulty)
+    GENERATION_RETRIES.observe(max(retries - 1, 0), language=programmingLanguage, difficulty=difficulty)
+
 
 builder = StateGraph(State)
 
-builder.add_node("question_generator",generate_questions_with_ai)
-builder.add_node("uniqueness_validator",uniqueness_validator)
+builder.add_node("question_generator",instrument_node("question_generator", generate_questions_with_ai))
+builder.add_node("uniqueness_validator",instrument_node("uniqueness_validator", uniqueness_validator, after=count_validation))
 # builder.add_node("final_validator",final_validator)
 
 
 builder.set_entry_point("question_generator")
 builder.add_edge("question_generator","uniqueness_validator")
-builder.add_conditional_edges("uniqueness_validator",router, {"generate_questions":"question_generator", "end":END})
+builder.add_conditional_edges("uniqueness_validator",instrument_router(router), {"generate_questions":"question_generator", "end":END})
 
 graph = builder.compile()
 
-def generate_questions(questionSetting: ChallengeRequest, db: Session, user_id: int):
+# Cap on how many saved titles a generation dedups against, newest kept, 0 means all
+EXISTING_TITLES_LIMIT = int(os.getenv("EXISTING_TITLES_LIMIT", "0"))
+EXISTING_TITLES_BATCH = 500
 
-    programmingLanguage = questionSetting.programmingLanguage
-    difficulty = questionSetting.difficulty
-    NO_QUESTIONS_TO_GENERATE = 10
+# Fan-out per difficulty as "<difficulty>:<shards>x<questions per shard>", 1xN turns it off
+DEFAULT_SHARD_SETTINGS = "easy:2x5,medium:2x5,hard:3x2"
 
-    if(questionSetting.difficulty == "hard"):
-        NO_QUESTIONS_TO_GENERATE = 5
 
+def parse_shard_settings(raw: str) -> dict:
+    settings = {}
+    for entry in raw.split(","):
+        if ":" not in entry:
+            continue
+        difficulty, plan = entry.split(":", 1)
+        shards, per_shard = plan.lower().split("x", 1)
+        settings[difficulty.strip().lower()] = (max(int(shards), 1), max(int(per_shard), 1))
+    return settings
 
-    existing_question_titles = [q.title for q in db.query(Challenge).filter(Challenge.user_id == user_id, Challenge.difficulty == questionSetting.difficulty, Challenge.programming_language == questionSetting.programmingLanguage)]
 
-    print("🐳🐳🐳🐳:::LOQ",len(existing_question_titles))
-    # return
+SHARD_SETTINGS = parse_shard_settings(os.getenv("QUESTION_SHARDS", DEFAULT_SHARD_SETTINGS))
+
+
+def shard_plan(difficulty: str) -> tuple:
+    return SHARD_SETTINGS.get((difficulty or "").lower(), (1, questions_to_generate(difficulty)))
+
+
+def questions_to_generate(difficulty: str) -> int:
+    if difficulty == "hard":
+        return 5
+    return 10
+
+
+@traced("db.load_existing_titles")
+async def load_existing_titles(db: AsyncSession, user_id: int, programming_language: str, difficulty: str, limit: int = EXISTING_TITLES_LIMIT):
+    """Titles only, newest first, streamed in batches instead of hydrating whole Challenge rows"""
+    stmt = (select(Challenge.title)
+            .where(Challenge.user_id == user_id, Challenge.programming_language == programming_language, Challenge.difficulty == difficulty)
+            .order_by(Challenge.date_created.desc()))
+    if limit:
+        stmt = stmt.limit(limit)
+
+    result = await db.stream_scalars(stmt.execution_options(yield_per=EXISTING_TITLES_BATCH))
+    return [title async for title in result]
+
+
+def build_entry_config(programmingLanguage: str, difficulty: str, existing_question_titles: list, user_id: Optional[int] = None) -> dict:
+    NO_QUESTIONS_TO_GENERATE = questions_to_generate(difficulty)
+    shards, questions_per_shard = shard_plan(difficulty)
+
     human_message=f"Please Generate {NO_QUESTIONS_TO_GENERATE} coding challenges/questions in {programmingLanguage} programming language. The difficulty level should be {difficulty}"
     
    
-    entry_config = {
+    return {
         "messages": [HumanMessage(content=human_message)],
+        "user_id": user_id,
         "difficulty": difficulty,
         "programmingLanguage": programmingLanguage,
         "duplicate_questions": [],
@@ -56,34 +171,111 @@ def generate_questions(questionSetting: ChallengeRequest, db: Session, user_id:
         "accepted_questions": [],
         "number_of_retries": 0,
         "number_of_questions_to_generate": NO_QUESTIONS_TO_GENERATE,
+        "shards": shards,
+        "questions_per_shard": questions_per_shard,
         "error": ""
         }
 
+
+def question_to_dict(question: QuestionModel) -> dict:
+    return {
+        "title": question.title,
+        "options": question.options,
+        "correct_answer_id": question.correct_answer_id,
+        "explanation": question.explanation
+    }
+
+
+async def run_question_graph(programmingLanguage: str, difficulty: str, existing_question_titles: list, user_id: Optional[int] = None):
+    """Runs the generation graph and returns the accepted questions as dicts"""
+    entry_config = build_entry_config(programmingLanguage, difficulty, existing_question_titles, user_id)
+    started = time.perf_counter()
+
     try:
-        response = graph.invoke(input=entry_config)
-
-        if len(response["accepted_questions"]) == 0 and response["error"] != "":
-            raise RuntimeError(response["error"])
-        
-        
-        questions = []
-        for t in response["accepted_questions"]:
-            question = {
-                "title": t.title,
-                "options": t.options,
-                "correct_answer_id": t.correct_answer_id,
-                "explanation": t.explanation
-            }
-            questions.append(question)
-
-
-        return questions
+        response = await graph.ainvoke(input=entry_config)
+    except Exception:
+        record_generation(started, "exception", 0, programmingLanguage, difficulty)
+        raise
+
+    if len(response["accepted_questions"]) == 0 and response["error"] != "":
+        record_generation(started, "error", response["number_of_retries"], programmingLanguage, difficulty)
+        raise RuntimeError(response["error"])
     
+    record_generation(started, "ok", response["number_of_retries"], programmingLanguage, difficulty)
+    return [question_to_dict(t) for t in response["accepted_questions"]]
 
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=f"Something went wrong!: {str(e)}")
 
+async def stream_question_graph(programmingLanguage: str, difficulty: str, existing_question_titles: list, user_id: Optional[int] = None):
+    """
+    Runs the generation graph and yields events as it goes:
+    {"type": "question"} as soon as a question clears validation (per shard when sharding is on),
+    {"type": "progress"} after every such question and validation pass, {"type": "retry"} when the router loops back.
+    """
+    entry_config = build_entry_config(programmingLanguage, difficulty, existing_question_titles, user_id)
+    target = entry_config["number_of_questions_to_generate"]
 
+    index = get_question_index(user_id, programmingLanguage, difficulty)
+    await asyncio.to_thread(index.sync, existing_question_titles)
+
+    emitted_titles = []
+    error = ""
+    retries = 0
+    started = time.perf_counter()
+    # Stays "cancelled" when the consumer stops iterating, e.g. on a client disconnect
+    outcome = "cancelled"
+
+    try:
+        # Closed on the early break too, otherwise the graph keeps running until it's garbage collected
+        async with aclosing(graph.astream(entry_config, stream_mode=["custom", "updates"])) as updates:
+            async for mode, chunk in updates:
+                update = None
+                if mode == "custom" and chunk.get("type") == "shard":
+                    candidates = chunk["questions"]
+                elif mode == "updates" and chunk.get("uniqueness_validator"):
+                    update = chunk["uniqueness_validator"]
+                    error = update.get("error", "")
+                    retries = update["number_of_retries"]
+                    candidates = [quest for quest in update["accepted_questions"] if quest.title not in emitted_titles]
+                else:
+                    continue
 
+                # Same check the validator runs, so questions can go out before the validation pass
+                unique, _ = index.select_unique(candidates, emitted_titles)
+                for question in unique[:target - len(emitted_titles)]:
+                    emitted_titles.append(question.title)
+                    yield {"type": "question", "question": question_to_dict(question)}
+                    # Shards can fill the target before the validator ever runs
+                    if update is None:
+                        yield {"type": "progress", "accepted": len(emitted_titles), "target": target, "retry": retries}
 
+                if update is not None:
+                    yield {"type": "progress", "accepted": len(emitted_titles), "target": target, "retry": update["number_of_retries"]}
+                    if router(update) == "generate_questions" and len(emitted_titles) < target:
+                        yield {"type": "retry", "retry": update["number_of_retries"], "missing": target - len(emitted_titles)}
 
+                if len(emitted_titles) >= target:
+                    break
+
+        outcome = "error" if not emitted_titles and error != "" else "ok"
+    except Exception:
+        outcome = "exception"
+        raise
+    finally:
+        record_generation(started, outcome, retries, programmingLanguage, difficulty)
+
+    if outcome == "error":
+        raise RuntimeError(error)
+
+
+async def generate_questions(questionSetting: ChallengeRequest, db: AsyncSession, user_id: int, existing_question_titles: Optional[list] = None):
+
+    if existing_question_titles is None:
+        existing_question_titles = await load_existing_titles(db, user_id, questionSetting.programmingLanguage, questionSetting.difficulty)
+
+    print("🐳🐳🐳🐳:::LOQ",len(existing_question_titles))
+
+    try:
+        return await run_question_graph(questionSetting.programmingLanguage, questionSetting.difficulty, existing_question_titles, user_id)
+
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=f"Something went wrong!: {str(e)}")
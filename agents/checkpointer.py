@@ -0,0 +1,249 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from typing import Optional
+
+from dotenv import load_dotenv
+from langgraph.checkpoint.memory import InMemorySaver
+
+
+load_dotenv()
+
+# memory | sqlite | postgres
+CHECKPOINTER_BACKEND = os.getenv("RESEARCHER_CHECKPOINTER", "memory").lower()
+CHECKPOINT_MAX_THREADS = int(os.getenv("CHECKPOINT_MAX_THREADS", "1000"))
+CHECKPOINT_MAX_BYTES = int(os.getenv("CHECKPOINT_MAX_BYTES", str(256 * 1024 * 1024)))
+CHECKPOINT_TTL_SECONDS = float(os.getenv("CHECKPOINT_TTL_SECONDS", str(24 * 3600)))
+CHECKPOINT_PRUNE_INTERVAL = float(os.getenv("CHECKPOINT_PRUNE_INTERVAL", "300"))
+CHECKPOINT_SQLITE_PATH = os.getenv("CHECKPOINT_SQLITE_PATH", "checkpoints.sqlite")
+CHECKPOINT_POSTGRES_URL = os.getenv("CHECKPOINT_POSTGRES_URL") or os.getenv("DATABASE_URL")
+
+# uuid6 timestamps count 100ns ticks from the gregorian calendar start
+_GREGORIAN_OFFSET = 0x01B21DD213814000
+
+
+def checkpoint_timestamp(checkpoint_id: str) -> float:
+    """Unix time a checkpoint was written, read back from its uuid6 id"""
+    value = uuid.UUID(checkpoint_id).int
+    ticks = ((value >> 96) << 28) | (((value >> 80) & 0xFFFF) << 12) | ((value >> 64) & 0x0FFF)
+    return (ticks - _GREGORIAN_OFFSET) / 1e7
+
+
+class BoundedMemorySaver(InMemorySaver):
+    """
+    InMemorySaver that forgets threads.
+    Threads idle for longer than the ttl are dropped, and the least recently used
+    ones go first whenever the thread or byte cap is exceeded.
+    """
+
+    def __init__(self, max_threads: int = CHECKPOINT_MAX_THREADS, max_bytes: int = CHECKPOINT_MAX_BYTES, ttl_seconds: float = CHECKPOINT_TTL_SECONDS):
+        super().__init__()
+        self.max_threads = max_threads
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.evictions = 0
+        self.total_bytes = 0
+        self._last_used: "OrderedDict[str, float]" = OrderedDict()
+        self._thread_bytes = defaultdict(int)
+        self._thread_keys = defaultdict(set)
+        self._guard = threading.RLock()
+
+    def _touch(self, thread_id: str):
+        self._last_used[thread_id] = time.monotonic()
+        self._last_used.move_to_end(thread_id)
+
+    def _account(self, thread_id: str, size: int):
+        self._thread_bytes[thread_id] += size
+        self.total_bytes += size
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with self._guard:
+            result = super().put(config, checkpoint, metadata, new_versions)
+            thread_id = config["configurable"]["thread_id"]
+            checkpoint_ns = config["configurable"]["checkpoint_ns"]
+
+            saved_checkpoint, saved_metadata, _ = self.storage[thread_id][checkpoint_ns][checkpoint["id"]]
+            size = len(saved_checkpoint[1]) + len(saved_metadata[1])
+            for channel, version in new_versions.items():
+                key = (thread_id, checkpoint_ns, channel, version)
+                self._thread_keys[thread_id].add(("blobs", key))
+                size += len(self.blobs[key][1])
+
+            self._account(thread_id, size)
+            self._touch(thread_id)
+            self.evict(keep=thread_id)
+            return result
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        with self._guard:
+            thread_id = config["configurable"]["thread_id"]
+            key = (thread_id, config["configurable"].get("checkpoint_ns", ""), config["configurable"]["checkpoint_id"])
+            before = sum(len(write[2][1]) for write in self.writes.get(key, {}).values())
+            super().put_writes(config, writes, task_id, task_path)
+            after = sum(len(write[2][1]) for write in self.writes.get(key, {}).values())
+
+            self._thread_keys[thread_id].add(("writes", key))
+            self._account(thread_id, after - before)
+            self._touch(thread_id)
+
+    def get_tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        with self._guard:
+            # The parent class creates empty entries for unknown threads, don't let lookups grow storage
+            if thread_id not in self.storage:
+                return None
+            self._touch(thread_id)
+            return super().get_tuple(config)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._guard:
+            namespaces = self.storage.pop(thread_id, {})
+            for checkpoint_ns, checkpoints in namespaces.items():
+                for checkpoint_id in checkpoints:
+                    self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            for store, key in self._thread_keys.pop(thread_id, ()):
+                getattr(self, store).pop(key, None)
+
+            self.total_bytes -= self._thread_bytes.pop(thread_id, 0)
+            self._last_used.pop(thread_id, None)
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """Drops expired threads, then least recently used ones until the caps hold"""
+        evicted = 0
+        with self._guard:
+            expired_before = time.monotonic() - self.ttl_seconds
+            for thread_id, last_used in list(self._last_used.items()):
+                if last_used >= expired_before:
+                    break
+                if thread_id != keep:
+                    self.delete_thread(thread_id)
+                    evicted += 1
+
+            for thread_id in list(self._last_used):
+                if len(self._last_used) <= self.max_threads and self.total_bytes <= self.max_bytes:
+                    break
+                if thread_id != keep:
+                    self.delete_thread(thread_id)
+                    evicted += 1
+
+            self.evictions += evicted
+        return evicted
+
+    def stats(self) -> dict:
+        with self._guard:
+            return {
+                "threads": len(self._last_used),
+                "bytes": self.total_bytes,
+                "max_threads": self.max_threads,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+
+class ResearcherCheckpointer:
+    """
+    Owns the researcher graph checkpointer.
+    memory keeps a bounded in-process store, sqlite/postgres persist threads so they
+    survive restarts and are shared between workers, with a periodic ttl/cap prune.
+    """
+
+    def __init__(self, backend: str = CHECKPOINTER_BACKEND):
+        self.backend = backend
+        self.evictions = 0
+        self._pool = None
+        self._pruner: Optional[asyncio.Task] = None
+        # The sqlite/postgres savers bind to the running loop, they are built in start()
+        self.saver = BoundedMemorySaver() if backend == "memory" else None
+
+    def _build_saver(self):
+        if self.backend == "sqlite":
+            try:
+                import aiosqlite
+                from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+            except ImportError:
+                raise RuntimeError("RESEARCHER_CHECKPOINTER=sqlite needs the langgraph-checkpoint-sqlite package")
+            # The connection is opened on first use by the saver's setup
+            return AsyncSqliteSaver(aiosqlite.connect(CHECKPOINT_SQLITE_PATH))
+
+        if self.backend == "postgres":
+            try:
+                from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+                from psycopg.rows import dict_row
+                from psycopg_pool import AsyncConnectionPool
+            except ImportError:
+                raise RuntimeError("RESEARCHER_CHECKPOINTER=postgres needs the langgraph-checkpoint-postgres and psycopg-pool packages")
+            if not CHECKPOINT_POSTGRES_URL:
+                raise RuntimeError("RESEARCHER_CHECKPOINTER=postgres needs CHECKPOINT_POSTGRES_URL or DATABASE_URL")
+
+            from sqlalchemy.engine import make_url
+            conninfo = make_url(CHECKPOINT_POSTGRES_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+            self._pool = AsyncConnectionPool(conninfo, open=False, kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row})
+            return AsyncPostgresSaver(self._pool)
+
+        raise RuntimeError(f"Unknown RESEARCHER_CHECKPOINTER backend: {self.backend}")
+
+    async def _latest_checkpoints(self) -> list:
+        sql = "SELECT thread_id, MAX(checkpoint_id) AS checkpoint_id FROM checkpoints GROUP BY thread_id"
+        if self.backend == "sqlite":
+            await self.saver.setup()
+            async with self.saver.lock, self.saver.conn.execute(sql) as cur:
+                return [(row[0], row[1]) for row in await cur.fetchall()]
+
+        async with self._pool.connection() as conn:
+            cursor = await conn.execute(sql)
+            return [(row["thread_id"], row["checkpoint_id"]) for row in await cursor.fetchall()]
+
+    async def prune(self) -> int:
+        """Applies the ttl and thread cap, returns how many threads were dropped"""
+        if isinstance(self.saver, BoundedMemorySaver):
+            return self.saver.evict()
+
+        expired_before = time.time() - CHECKPOINT_TTL_SECONDS
+        threads = sorted(await self._latest_checkpoints(), key=lambda row: row[1], reverse=True)
+
+        stale = [thread_id for position, (thread_id, checkpoint_id) in enumerate(threads)
+                 if position >= CHECKPOINT_MAX_THREADS or checkpoint_timestamp(checkpoint_id) < expired_before]
+        for thread_id in stale:
+            await self.saver.adelete_thread(thread_id)
+
+        self.evictions += len(stale)
+        return len(stale)
+
+    async def _prune_forever(self):
+        while True:
+            await asyncio.sleep(CHECKPOINT_PRUNE_INTERVAL)
+            try:
+                await self.prune()
+            except Exception as e:
+                print(f"Checkpoint prune failed: {str(e)}")
+
+    async def start(self):
+        if self.saver is None:
+            self.saver = self._build_saver()
+            if self._pool is not None:
+                await self._pool.open()
+            await self.saver.setup()
+        if self._pruner is None:
+            self._pruner = asyncio.create_task(self._prune_forever())
+
+    async def stop(self):
+        if self._pruner is not None:
+            self._pruner.cancel()
+            await asyncio.gather(self._pruner, return_exceptions=True)
+            self._pruner = None
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+        if self.backend == "sqlite" and self.saver is not None:
+            await self.saver.conn.close()
+
+    def stats(self) -> dict:
+        if isinstance(self.saver, BoundedMemorySaver):
+            return {"backend": self.backend, **self.saver.stats()}
+        return {"backend": self.backend, "evictions": self.evictions}
+
+
+researcher_checkpointer = ResearcherCheckpointer()
@@ -0,0 +1,172 @@
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+from ..agents.agent_schemas import QuestionModel
+
+
+load_dotenv()
+
+# Titles are compared on character shingles, so two questions that only differ by
+# a variable name or a literal still land next to each other.
+SHINGLE_SIZE = int(os.getenv("DEDUP_SHINGLE_SIZE", "5"))
+NUM_PERMUTATIONS = int(os.getenv("DEDUP_NUM_PERMUTATIONS", "64"))
+LSH_BANDS = int(os.getenv("DEDUP_LSH_BANDS", "16"))
+SIMILARITY_THRESHOLD = float(os.getenv("DEDUP_SIMILARITY_THRESHOLD", "0.8"))
+MIN_TITLE_LENGTH = int(os.getenv("DEDUP_MIN_TITLE_LENGTH", "12"))
+MAX_CACHED_INDEXES = int(os.getenv("DEDUP_MAX_CACHED_INDEXES", "1024"))
+
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.default_rng(1)
+_PERM_A = _rng.integers(1, (1 << 31) - 1, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_PERM_B = _rng.integers(0, (1 << 31) - 1, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+_whitespace = re.compile(r"\s+")
+
+
+def normalize_title(title: str) -> str:
+    return _whitespace.sub(" ", title or "").strip().lower()
+
+
+def _shingle_hashes(text: str) -> np.ndarray:
+    if len(text) <= SHINGLE_SIZE:
+        shingles = {text}
+    else:
+        shingles = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    hashes = np.fromiter((zlib.crc32(s.encode()) for s in shingles), dtype=np.uint64, count=len(shingles))
+    return hashes % _MERSENNE_PRIME
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    """MinHash signature of a normalized title, one row per permutation"""
+    hashes = _shingle_hashes(text)
+    permuted = (_PERM_A[:, None] * hashes[None, :] + _PERM_B[:, None]) % _MERSENNE_PRIME
+    return permuted.min(axis=1)
+
+
+class NearDuplicateIndex:
+    """
+    MinHash/LSH index over question titles.
+    Lookups only compare against the signatures sharing at least one LSH band,
+    so checking a title stays in the millisecond range for thousands of saved titles.
+    """
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD, bands: int = LSH_BANDS):
+        if NUM_PERMUTATIONS % bands != 0:
+            raise ValueError("DEDUP_NUM_PERMUTATIONS must be divisible by DEDUP_LSH_BANDS")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = NUM_PERMUTATIONS // bands
+        self._signatures: List[np.ndarray] = []
+        self._buckets: List[dict] = [{} for _ in range(bands)]
+        self._exact: set = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def _similarity(self, signature: np.ndarray) -> float:
+        candidates = set()
+        for band, key in self._band_keys(signature):
+            candidates.update(self._buckets[band].get(key, ()))
+        if not candidates:
+            return 0.0
+        stacked = np.stack([self._signatures[i] for i in candidates])
+        return float((stacked == signature).mean(axis=1).max())
+
+    def add(self, title: str) -> bool:
+        normalized = normalize_title(title)
+        if not normalized:
+            return False
+        with self._lock:
+            if normalized in self._exact:
+                return False
+            signature = minhash_signature(normalized)
+            position = len(self._signatures)
+            self._signatures.append(signature)
+            self._exact.add(normalized)
+            for band, key in self._band_keys(signature):
+                self._buckets[band].setdefault(key, []).append(position)
+        return True
+
+    def sync(self, titles: Iterable[str]) -> int:
+        """Index every title not seen yet, returns how many were added"""
+        return sum(1 for title in titles if self.add(title))
+
+    def is_duplicate(self, title: str) -> bool:
+        normalized = normalize_title(title)
+        if normalized in self._exact:
+            return True
+        with self._lock:
+            return self._similarity(minhash_signature(normalized)) >= self.threshold
+
+    def select_unique(
+        self,
+        questions: List[QuestionModel],
+        accepted_titles: Iterable[str] = (),
+    ) -> Tuple[List[QuestionModel], List[QuestionModel]]:
+        """
+        Split a generated batch into (unique, duplicates).
+        A question is a duplicate when it is near an indexed title, near an already
+        accepted title or near an earlier question of the same batch. Titles too short
+        to be a complete question are rejected as well.
+        """
+        batch = NearDuplicateIndex(threshold=self.threshold, bands=self.bands)
+        batch.sync(accepted_titles)
+
+        unique, duplicates = [], []
+        for question in questions:
+            normalized = normalize_title(question.title)
+            if len(normalized) < MIN_TITLE_LENGTH or self.is_duplicate(normalized) or batch.is_duplicate(normalized):
+                duplicates.append(question)
+                continue
+            batch.add(normalized)
+            unique.append(question)
+
+        return unique, duplicates
+
+
+_indexes: "OrderedDict[tuple, NearDuplicateIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _index_key(user_id: Optional[int], programming_language: str, difficulty: str) -> tuple:
+    return (user_id, (programming_language or "").lower(), (difficulty or "").lower())
+
+
+def get_question_index(user_id: Optional[int], programming_language: str, difficulty: str) -> NearDuplicateIndex:
+    """
+    Per user and (programming_language, difficulty) index, least recently used ones are dropped.
+    Generations without a user (e.g the question pool) get a throwaway index.
+    """
+    if user_id is None:
+        return NearDuplicateIndex()
+
+    key = _index_key(user_id, programming_language, difficulty)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = NearDuplicateIndex()
+            _indexes[key] = index
+            while len(_indexes) > MAX_CACHED_INDEXES:
+                _indexes.popitem(last=False)
+        else:
+            _indexes.move_to_end(key)
+        return index
+
+
+def remember_titles(user_id: Optional[int], programming_language: str, difficulty: str, titles: Iterable[str]):
+    """Add freshly saved titles to an index that is already loaded, cold indexes get seeded from the db later"""
+    with _indexes_lock:
+        index = _indexes.get(_index_key(user_id, programming_language, difficulty))
+    if index is not None:
+        index.sync(titles)
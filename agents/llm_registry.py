@@ -0,0 +1,169 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.runnables import RunnableLambda
+from langchain_core.runnables.config import merge_configs
+from ..metrics import generation_labels, metrics
+from ..tracing import tracer
+
+
+load_dotenv()
+
+# Which model each agent role runs on, LLM_MODEL_<ROLE> overrides one, e.g. LLM_MODEL_RESEARCHER
+DEFAULT_ROLE_MODELS = {
+    "question_generator": "gemini-2.5-flash",
+    "researcher": "gemini-2.5-flash",
+    "context_summary": "gemini-2.0-flash-001",
+}
+# Calls in flight per model across the whole process, LLM_CONCURRENCY overrides per model as "<model>:<n>,..."
+DEFAULT_MODEL_CONCURRENCY = int(os.getenv("LLM_DEFAULT_CONCURRENCY", "8"))
+
+LLM_CALL_SECONDS = metrics.histogram("llm_call_seconds", "Wall time per LLM call, semaphore wait excluded", ("model", "role", "language", "difficulty", "outcome"))
+LLM_WAIT_SECONDS = metrics.histogram("llm_semaphore_wait_seconds", "Time an LLM call waited for its model's concurrency slot", ("model",))
+LLM_TOKENS = metrics.counter("llm_tokens_total", "Tokens reported by the model per direction", ("model", "role", "direction", "language", "difficulty"))
+
+
+def parse_concurrency_settings(raw: str) -> Dict[str, int]:
+    limits = {}
+    for part in raw.split(","):
+        model, _, limit = part.strip().rpartition(":")
+        if model and limit.isdigit():
+            limits[model] = max(int(limit), 1)
+    return limits
+
+
+def gemini_client(model: str):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model=model)
+
+
+class UsageRecorder(AsyncCallbackHandler):
+    """Reads usage_metadata off finished generations, works for structured output and streams too"""
+
+    def __init__(self, labels: dict):
+        self.labels = labels
+
+    async def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    LLM_TOKENS.inc(usage.get("input_tokens", 0), direction="input", **self.labels)
+                    LLM_TOKENS.inc(usage.get("output_tokens", 0), direction="output", **self.labels)
+
+
+class LLMRegistry:
+    """
+    One client per model shared by every role on it, bound runnables (structured output,
+    tools) cached per role, and a per-model semaphore so the upstream concurrency has one knob.
+    Everything is built on first use.
+    """
+
+    def __init__(self, client_factory: Callable[[str], Any] = gemini_client):
+        self.client_factory = client_factory
+        self.role_models = {role: os.getenv(f"LLM_MODEL_{role.upper()}", model) for role, model in DEFAULT_ROLE_MODELS.items()}
+        self.concurrency = parse_concurrency_settings(os.getenv("LLM_CONCURRENCY", ""))
+        self._clients: Dict[str, Any] = {}
+        self._runnables: Dict[tuple, Any] = {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def model_for(self, role: str) -> str:
+        if role not in self.role_models:
+            raise KeyError(f"Unknown LLM role: {role}")
+        return self.role_models[role]
+
+    def client(self, model: str):
+        with self._lock:
+            if model not in self._clients:
+                self._clients[model] = self.client_factory(model)
+            return self._clients[model]
+
+    def set_client(self, model: str, client: Any):
+        """Swap the client behind a model, e.g. for offline fakes, cached runnables are rebuilt"""
+        with self._lock:
+            self._clients[model] = client
+            self._runnables = {key: runnable for key, runnable in self._runnables.items() if key[1] != model}
+
+    def _semaphore(self, model: str) -> asyncio.Semaphore:
+        if model not in self._semaphores:
+            self._semaphores[model] = asyncio.Semaphore(self.concurrency.get(model, DEFAULT_MODEL_CONCURRENCY))
+            self._in_flight[model] = 0
+        return self._semaphores[model]
+
+    def _limited(self, model: str, role: str, runnable, name: str):
+        async def call(input, config):
+            with tracer.span("llm.call", model=model, role=role):
+                async with self._semaphore(model):
+                    self._in_flight[model] += 1
+                    try:
+                        return await runnable.ainvoke(input, config)
+                    finally:
+                        self._in_flight[model] -= 1
+
+        return RunnableLambda(call, name=name)
+
+    def _measured(self, model: str, role: str, runnable, name: str):
+        """Same as _limited, plus wall time, queue wait and token usage per call"""
+        async def call(input, config):
+            labels = {"model": model, "role": role, **generation_labels.get()}
+            queued = time.perf_counter()
+            with tracer.span("llm.call", model=model, role=role):
+                async with self._semaphore(model):
+                    started = time.perf_counter()
+                    LLM_WAIT_SECONDS.observe(started - queued, model=model)
+                    self._in_flight[model] += 1
+                    outcome = "error"
+                    try:
+                        result = await runnable.ainvoke(input, merge_configs(config, {"callbacks": [UsageRecorder(labels)]}))
+                        outcome = "ok"
+                        return result
+                    except asyncio.CancelledError:
+                        # Shards still running once enough questions are in get cancelled
+                        outcome = "cancelled"
+                        raise
+                    finally:
+                        self._in_flight[model] -= 1
+                        LLM_CALL_SECONDS.observe(time.perf_counter() - started, outcome=outcome, **labels)
+
+        return RunnableLambda(call, name=name)
+
+    def _cached(self, role: str, kind: str, extra: Any, build: Callable[[Any], Any]):
+        model = self.model_for(role)
+        key = (role, model, kind, extra)
+        runnable = self._runnables.get(key)
+        if runnable is None:
+            if metrics.enabled:
+                runnable = self._measured(model, role, build(self.client(model)), f"{role}_{kind}")
+            else:
+                runnable = self._limited(model, role, build(self.client(model)), f"{role}_{kind}")
+            self._runnables[key] = runnable
+        return runnable
+
+    def chat(self, role: str):
+        return self._cached(role, "chat", None, lambda client: client)
+
+    def structured(self, role: str, schema):
+        return self._cached(role, "structured", schema, lambda client: client.with_structured_output(schema))
+
+    def with_tools(self, role: str, tools: list):
+        return self._cached(role, "tools", tuple(tool.name for tool in tools), lambda client: client.bind_tools(tools=tools))
+
+    def warm(self, roles: Optional[list] = None):
+        for role in roles or self.role_models:
+            self.client(self.model_for(role))
+
+    def stats(self) -> dict:
+        return {
+            model: {"in_flight": self._in_flight.get(model, 0), "limit": self.concurrency.get(model, DEFAULT_MODEL_CONCURRENCY)}
+            for model in set(self.role_models.values())
+        }
+
+
+llm_registry = LLMRegistry()
@@ -1,33 +1,46 @@
-from langchain_core.messages import SystemMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.messages import HumanMessage, SystemMessage
 
-from langgraph.types import Command
-from langgraph.graph import END
+from langgraph.config import get_stream_writer
 from dotenv import load_dotenv
-import os
-from ..agents.agent_schemas import QuestionOutput, State
+from typing import List, Optional
+import asyncio
+import math
+from ..agents.agent_schemas import QuestionModel, QuestionOutput, QuestionShardOutput, State
+from ..agents.dedup_index import NearDuplicateIndex
+from ..agents.llm_registry import llm_registry
+from ..tracing import traced
 
 
 load_dotenv()
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash")
-
-
-def generate_questions_with_ai(state: State) -> State:
-    NO_OF_QUESTIONS_TO_GENERATE = state["number_of_questions_to_generate"]
-    print("NODE-1State")
-    try:
-        if state["number_of_retries"] >= 4:
-            state["error"] = "Maximum retries exceeded!"
-            return state
-        
-   
-        if len(state["duplicate_questions"]) > 0:
-            NO_OF_QUESTIONS_TO_GENERATE = len(state["duplicate_questions"])
-          
-         
-        system_prompt = f"""
+LLM_ROLE = "question_generator"
+
+
+# Topic slices handed out to the shards so concurrent generations don't overlap
+TOPIC_SLICES = [
+    "booleans and comparisons",
+    "arithmetic and operator precedence",
+    "string operations",
+    "indexing and slicing",
+    "control flow",
+    "functions and scope",
+    "error handling",
+    "common algorithms",
+    "data structures",
+    "iteration patterns",
+    "object-oriented patterns",
+    "advanced language features",
+]
+
+
+def build_system_prompt(state: State, number_of_questions: int, topics: Optional[List[str]] = None) -> str:
+    if topics:
+        topic_focus = f"Only cover these topics, spread the questions across them: {', '.join(topics)}."
+    else:
+        topic_focus = "Cover a variety of topics like booleans, arithmetic, string ops, indexing, control flow, functions, error handling, and common algorithms."
+
+    return f"""
             You are an expert coding challenge creator for Python, TypeScript, and JavaScript.
-            Your task is to generate {NO_OF_QUESTIONS_TO_GENERATE} high-quality coding questions, each with 4 multiple-choice answers and exactly one correct answer.
+            Your task is to generate {number_of_questions} high-quality coding questions, each with 4 multiple-choice answers and exactly one correct answer.
 
             Each question must match the following constraints:
             - Programming Language: {state['programmingLanguage']}
@@ -44,7 +57,7 @@ def generate_questions_with_ai(state: State) -> State:
             1. **COMPLETENESS IS THE ABSOLUTE PRIORITY.** Do not generate incomplete questions. **If a question refers to a code snippet, that *full and complete* code snippet MUST be included directly within the 'title' field.** For example, "What's the final output of this JavaScript code snippet?" is incomplete without the actual snippet. Each generated question should have a different title, avoid using the same starting phrase (e.g, what is the output of the code....). The questions/title shouldn't be boring, apply wit and logic to each generated question.
             2. Avoid redundant or overly similar questions (e.g., don’t create multiple questions about the output of a code, `len()` or simple print statements). Ensure to touch different topics and apply different logic in the generated question, regardless of the difficulty.
             3. Ensure conceptual diversity:
-            - Cover a variety of topics like booleans, arithmetic, string ops, indexing, control flow, functions, error handling, and common algorithms.
+            - {topic_focus}
             4. Keep the question titles clear, concise, and semantically distinct from one another.
 
             5. **CRITICAL REQUIREMENT: The 'title' field MUST contain the *entire* question, including any and all code snippets, examples, or data structures that the question refers to. Never generate a 'title' that requires external context (like a missing code block).**
@@ -59,13 +72,80 @@ def generate_questions_with_ai(state: State) -> State:
             Please ensure random placement of the correct answer among the options.
             **FINAL REMINDER: DO NOT generate INCOMPLETE questions. Every 'title' must be self-contained and include all referenced code.**
             """
+
+
+def topic_slices(number_of_shards: int) -> List[List[str]]:
+    return [TOPIC_SLICES[i::number_of_shards] for i in range(number_of_shards)]
+
+
+async def generate_sharded(state: State, number_of_questions: int, number_of_shards: int, questions_per_shard: int) -> List[QuestionModel]:
+    """
+    Fans the generation out to concurrent smaller calls, each on its own topic slice.
+    Shards are merged as they finish, deduplicated across each other and the
+    remaining shards are cancelled once enough questions are in.
+    """
+    llm_ws = llm_registry.structured(LLM_ROLE, QuestionShardOutput)
+    writer = get_stream_writer()
+    accepted_titles = [quest.title for quest in state["accepted_questions"]]
+
+    # The original human message asks for the full count, each shard gets its own
+    shard_message = HumanMessage(content=f"Please Generate {questions_per_shard} coding challenges/questions in {state['programmingLanguage']} programming language. The difficulty level should be {state['difficulty']}")
+    shards = [
+        asyncio.create_task(llm_ws.ainvoke([SystemMessage(content=build_system_prompt(state, questions_per_shard, topics)), shard_message]))
+        for topics in topic_slices(number_of_shards)
+    ]
+
+    merged = []
+    try:
+        for shard in asyncio.as_completed(shards):
+            try:
+                response = await shard
+            except Exception as e:
+                print(f"Question shard failed: {str(e)}")
+                continue
+
+            unique, _ = NearDuplicateIndex().select_unique(response.questions, accepted_titles + [quest.title for quest in merged])
+            merged.extend(unique)
+            # Lets the streaming route send questions before the other shards are done
+            writer({"type": "shard", "questions": unique})
+            if len(merged) >= number_of_questions:
+                break
+    finally:
+        for shard in shards:
+            shard.cancel()
+
+    if not merged:
+        raise RuntimeError("All question shards failed")
+    return merged
+
+
+@traced("graph.question_generator")
+async def generate_questions_with_ai(state: State) -> State:
+    NO_OF_QUESTIONS_TO_GENERATE = state["number_of_questions_to_generate"]
+    print("NODE-1State")
+    try:
+        if state["number_of_retries"] >= 4:
+            state["error"] = "Maximum retries exceeded!"
+            return state
         
-       
-        llm_ws = llm.with_structured_output(QuestionOutput)
+   
+        if len(state["duplicate_questions"]) > 0:
+            NO_OF_QUESTIONS_TO_GENERATE = len(state["duplicate_questions"])
+          
+         
+        
+        number_of_shards = min(state.get("shards", 1), math.ceil(NO_OF_QUESTIONS_TO_GENERATE / max(state.get("questions_per_shard", 1), 1)))
+
+        if number_of_shards > 1:
+            state["generated_questions"] = await generate_sharded(state, NO_OF_QUESTIONS_TO_GENERATE, number_of_shards, state["questions_per_shard"])
+        else:
+            system_prompt = build_system_prompt(state, NO_OF_QUESTIONS_TO_GENERATE)
+
+            llm_ws = llm_registry.structured(LLM_ROLE, QuestionOutput)
         
-        response = llm_ws.invoke([SystemMessage(content=system_prompt) ] + state["messages"])
+            response = await llm_ws.ainvoke([SystemMessage(content=system_prompt) ] + state["messages"])
      
-        state["generated_questions"] = response.questions
+            state["generated_questions"] = response.questions
 
         state["duplicate_questions"] = []
 
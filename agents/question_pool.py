@@ -0,0 +1,141 @@
+import asyncio
+import os
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from ..agents.ai_generator import run_question_graph
+
+
+load_dotenv()
+
+POOL_ENABLED = os.getenv("QUESTION_POOL_ENABLED", "false").lower() == "true"
+# Questions kept ready per (programmingLanguage, difficulty)
+POOL_SIZE = int(os.getenv("QUESTION_POOL_SIZE", "30"))
+# Refill starts once a pool drops below this many questions
+POOL_LOW_WATER = int(os.getenv("QUESTION_POOL_LOW_WATER", "10"))
+# Max graph runs in flight across all pools
+POOL_REFILL_CONCURRENCY = int(os.getenv("QUESTION_POOL_REFILL_CONCURRENCY", "2"))
+POOL_REFILL_INTERVAL = float(os.getenv("QUESTION_POOL_REFILL_INTERVAL", "60"))
+POOL_LANGUAGES = [lang.strip().lower() for lang in os.getenv("QUESTION_POOL_LANGUAGES", "python,javascript,typescript").split(",") if lang.strip()]
+POOL_DIFFICULTIES = [diff.strip().lower() for diff in os.getenv("QUESTION_POOL_DIFFICULTIES", "easy,medium,hard").split(",") if diff.strip()]
+
+
+class QuestionPool:
+    """
+    Keeps validated questions ready per (programmingLanguage, difficulty) so the
+    generate-challenge route can answer without running the graph.
+    A background worker refills any pool that falls under the low-water mark.
+    """
+
+    def __init__(
+        self,
+        languages: List[str] = POOL_LANGUAGES,
+        difficulties: List[str] = POOL_DIFFICULTIES,
+        size: int = POOL_SIZE,
+        low_water: int = POOL_LOW_WATER,
+        refill_concurrency: int = POOL_REFILL_CONCURRENCY,
+        enabled: bool = POOL_ENABLED,
+    ):
+        self.enabled = enabled
+        self.size = size
+        self.low_water = low_water
+        self.refill_concurrency = max(refill_concurrency, 1)
+        self._pools: Dict[Tuple[str, str], deque] = {(lang, diff): deque() for lang in languages for diff in difficulties}
+        self._refilling: set = set()
+        self._refills: set = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(programming_language: str, difficulty: str) -> Tuple[str, str]:
+        return ((programming_language or "").lower(), (difficulty or "").lower())
+
+    def stats(self) -> dict:
+        return {f"{lang}:{diff}": len(pool) for (lang, diff), pool in self._pools.items()}
+
+    def take(self, programming_language: str, difficulty: str, count: int, is_seen: Callable[[str], bool]) -> Optional[List[dict]]:
+        """
+        Pops `count` questions the user hasn't seen yet.
+        Returns None (and leaves the pool untouched) when it can't serve the full set.
+        """
+        if not self.enabled:
+            return None
+
+        key = self._key(programming_language, difficulty)
+        pool = self._pools.get(key)
+        if pool is None:
+            return None
+
+        picked = []
+        for question in pool:
+            if not is_seen(question["title"]):
+                picked.append(question)
+                if len(picked) == count:
+                    break
+
+        if len(picked) < count:
+            self.wake()
+            return None
+
+        picked_ids = {id(question) for question in picked}
+        self._pools[key] = deque(question for question in pool if id(question) not in picked_ids)
+
+        if len(self._pools[key]) < self.low_water:
+            self.wake()
+
+        return picked
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _refill(self, key: Tuple[str, str], semaphore: asyncio.Semaphore):
+        programming_language, difficulty = key
+        try:
+            while len(self._pools[key]) < self.size:
+                async with semaphore:
+                    existing_titles = [question["title"] for question in self._pools[key]]
+                    questions = await run_question_graph(programming_language, difficulty, existing_titles)
+
+                if not questions:
+                    break
+                self._pools[key].extend(questions[:self.size - len(self._pools[key])])
+        except Exception as e:
+            print(f"Question pool refill failed for {key}: {str(e)}")
+        finally:
+            self._refilling.discard(key)
+
+    async def _run(self):
+        semaphore = asyncio.Semaphore(self.refill_concurrency)
+        while True:
+            for key, pool in self._pools.items():
+                if len(pool) < self.low_water and key not in self._refilling:
+                    self._refilling.add(key)
+                    task = asyncio.create_task(self._refill(key, semaphore))
+                    self._refills.add(task)
+                    task.add_done_callback(self._refills.discard)
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=POOL_REFILL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if not self.enabled or self._worker is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is None:
+            return
+        tasks = [self._worker, *self._refills]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker = None
+
+
+question_pool = QuestionPool()
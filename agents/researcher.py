@@ -1,11 +1,17 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_community.tools.tavily_search import TavilySearchResults
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import add_messages, StateGraph, END
-from langchain_core.messages import ToolMessage,SystemMessage
+from langchain_core.messages import HumanMessage, RemoveMessage, ToolMessage, SystemMessage, get_buffer_string
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.callbacks import adispatch_custom_event
 from dotenv import load_dotenv
+from ..agents.checkpointer import researcher_checkpointer
+from ..agents.llm_registry import llm_registry
+from ..agents.search_cache import search_cache
+from ..tracing import traced, tracer
+from functools import lru_cache
 from typing import TypedDict, Annotated
+import asyncio
 import os
+import re
 from datetime import datetime
 
 
@@ -14,24 +20,105 @@ model1= "mistralai/mistral-7b-instruct:free"
 model2= "mistralai/mistral-small-3.2-24b-instruct:free"
 g_model1= "gemini-2.0-flash-001"
 g_model2 = "gemini-2.5-flash"
-llm = ChatGoogleGenerativeAI(model=g_model2)
 # llm = ChatOpenAI(model=model2, api_key=os.environ["open_router_api_key"], base_url="https://openrouter.ai/api/v1")
 # llm = ChatOpenAI( model="gpt-4o")
 
 # llm = ChatGroq(model="meta-llama/llama-4-scout-17b-16e-instruct", api_key=os.getenv("GROQ_API_KEY"))
 
-search_tool = TavilySearchResults(max_results=4)
-tools = [search_tool]
-memory = MemorySaver()
+TOOL_CALL_CONCURRENCY = int(os.getenv("RESEARCHER_TOOL_CONCURRENCY", "4"))
+TOOL_CALL_TIMEOUT = float(os.getenv("RESEARCHER_TOOL_TIMEOUT", "20"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("RESEARCHER_CONTEXT_TOKENS", "6000"))
+KEEP_RECENT_TURNS = max(int(os.getenv("RESEARCHER_KEEP_RECENT_TURNS", "2")), 1)
+COLLAPSED_PREFIX = "[collapsed search results]"
+SUMMARY_TAG = "context_summary"
+
+
+# Clients are built on first use, or by warm_clients() at startup
+
+@lru_cache(maxsize=None)
+def get_search_tool():
+    from langchain_community.tools.tavily_search import TavilySearchResults
+    return TavilySearchResults(max_results=4)
+
+
+def get_llm_with_tools():
+    return llm_registry.with_tools("researcher", [get_search_tool()])
+
+
+@lru_cache(maxsize=None)
+def get_summary_llm():
+    # Tagged so the SSE route doesn't stream summaries to the user
+    return llm_registry.chat("context_summary").with_config(tags=[SUMMARY_TAG])
+
+
+def warm_clients():
+    get_search_tool()
+    llm_registry.warm(["researcher", "context_summary"])
 
-llm_with_tools = llm.bind_tools(tools=tools)
 
 class State(TypedDict):   
     """
     Graph state schema
     """
     messages: Annotated[list, add_messages]
+    summary: str
+
+
+def collapse_tool_message(message: ToolMessage) -> ToolMessage:
+    """Keeps only the sources of a search dump, same id so add_messages replaces it in place"""
+    urls = re.findall(r"'url': '([^']+)'", str(message.content))
+    return ToolMessage(
+        id=message.id,
+        content=f"{COLLAPSED_PREFIX} sources: {', '.join(urls) if urls else 'none'}",
+        tool_call_id=message.tool_call_id,
+        name=message.name,
+    )
+
 
+async def summarize_messages(summary: str, messages: list) -> str:
+    prompt = (
+        "Condense the conversation below into a short summary for a research assistant that will continue it. "
+        "Keep the user's questions and goals, the key facts and figures found, and the source urls. "
+        f"Extend the existing summary instead of repeating it.\n\nExisting summary:\n{summary or 'none'}\n\nConversation:\n{get_buffer_string(messages)}"
+    )
+    result = await get_summary_llm().ainvoke([HumanMessage(content=prompt)])
+    return str(result.content)
+
+
+@traced("graph.researcher.context_manager")
+async def context_manager(state: State):
+    """
+    Keeps the prompt inside the token budget before the model runs.
+    Tool dumps from earlier turns are collapsed to their sources, and once the history is
+    still over budget everything before the last turns is folded into the stored summary.
+    Both changes land in the checkpoint, so they are computed once per thread.
+    """
+    messages = state["messages"]
+    turn_starts = [position for position, message in enumerate(messages) if isinstance(message, HumanMessage)]
+    if not turn_starts:
+        return {}
+
+    replaced = {}
+    for message in messages[:turn_starts[-1]]:
+        if isinstance(message, ToolMessage) and not str(message.content).startswith(COLLAPSED_PREFIX):
+            replaced[message.id] = collapse_tool_message(message)
+    compacted = [replaced.get(message.id, message) for message in messages]
+
+    summary = state.get("summary", "")
+    if count_tokens_approximately(compacted) + len(summary) // 4 <= CONTEXT_TOKEN_BUDGET or len(turn_starts) <= KEEP_RECENT_TURNS:
+        return {"messages": list(replaced.values())} if replaced else {}
+
+    # Only cut on a turn boundary so tool calls stay next to their results
+    cut = turn_starts[-KEEP_RECENT_TURNS]
+    folded = compacted[:cut]
+    folded_ids = {message.id for message in folded}
+
+    return {
+        "messages": [RemoveMessage(id=message.id) for message in folded] + [message for message in replaced.values() if message.id not in folded_ids],
+        "summary": await summarize_messages(summary, folded),
+    }
+
+@traced("graph.researcher.model")
 async def model(state: State):
     """
     model node function
@@ -42,8 +129,11 @@ async def model(state: State):
     print("✅✅✅✅:",today, formatted)
     system_prompt = f"You are a well trained research assistant with a search tool at your disposal, the tool should be used only when necessary. While using the tool, results might point to different dates, in other to avoid confusion, todays date is {today}, in formatted string - {formatted}"
 
+    if state.get("summary"):
+        system_prompt += f"\n\nSummary of the earlier conversation: {state['summary']}"
+
 
-    result = await llm_with_tools.ainvoke([SystemMessage(content=system_prompt)] + state["messages"])
+    result = await get_llm_with_tools().ainvoke([SystemMessage(content=system_prompt)] + state["messages"])
     return {"messages": [result]}
 
 async def router(state: State):
@@ -56,30 +146,69 @@ async def router(state: State):
         return "tool_node"
     return "end"
 
+async def run_tool_call(tool_call: dict, semaphore: asyncio.Semaphore) -> ToolMessage:
+    """Runs one tool call, failures and timeouts come back as an error ToolMessage"""
+    tool_name = tool_call["name"]
+    tool_args = tool_call["args"]
+    tool_id = tool_call["id"]
+
+    if tool_name != "tavily_search_results_json":
+        return ToolMessage(content=f"Error: unknown tool {tool_name}", tool_call_id=tool_id, name=tool_name, status="error")
+
+    search_tool = get_search_tool()
+
+    async def search():
+        # Only runs on a cache miss, so this span is the actual Tavily round trip
+        with tracer.span("tavily.search"):
+            return await search_tool.ainvoke(tool_args)
+
+    try:
+        async with semaphore:
+            with tracer.span("tool.search", query=tool_args.get("query", "")):
+                search_results = await asyncio.wait_for(
+                    search_cache.get_or_search(tool_args.get("query", ""), search_tool.max_results, search),
+                    timeout=TOOL_CALL_TIMEOUT,
+                )
+    except asyncio.TimeoutError:
+        return ToolMessage(content=f"Error: search timed out after {TOOL_CALL_TIMEOUT}s", tool_call_id=tool_id, name=tool_name, status="error")
+    except Exception as e:
+        return ToolMessage(content=f"Error: search failed: {str(e)}", tool_call_id=tool_id, name=tool_name, status="error")
+
+    # Cache hits never reach the tool, so the results are announced here for the SSE stream
+    await adispatch_custom_event("search_results", {"output": search_results})
+    return ToolMessage(content=str(search_results),tool_call_id = tool_id, name=tool_name)
+
+
+@traced("graph.researcher.tool_node")
 async def tool_node(state):
-    """Custom tool node that handles tool calls from LLM."""
+    """Custom tool node that handles tool calls from LLM, all calls of a turn run concurrently."""
     tool_calls = state["messages"][-1].tool_calls
 
-    tool_messages = []
+    semaphore = asyncio.Semaphore(TOOL_CALL_CONCURRENCY)
+    # gather keeps the tool_calls order, so every ToolMessage lines up with its tool_call_id
+    tool_messages = await asyncio.gather(*(run_tool_call(tool_call, semaphore) for tool_call in tool_calls))
 
-    for tool_call in tool_calls:
-        tool_name = tool_call["name"]
-        tool_args = tool_call["args"]
-        tool_id = tool_call["id"]
-
-        if tool_name == "tavily_search_results_json":
-            search_results = await search_tool.ainvoke(tool_args) 
-            tool_message = ToolMessage(content=str(search_results),tool_call_id = tool_id, name=tool_name)
-            tool_messages.append(tool_message)
-    
-    return {"messages": tool_messages}
+    return {"messages": list(tool_messages)}
 
 graph_form = StateGraph(State)
 graph_form.add_node("model", model)
 graph_form.add_node("tool_node", tool_node)
 
-graph_form.set_entry_point("model")
+graph_form.add_node("context_manager", context_manager)
+
+graph_form.set_entry_point("context_manager")
+graph_form.add_edge("context_manager", "model")
 graph_form.add_conditional_edges("model", router, {"tool_node":"tool_node", "end":END})
 graph_form.add_edge("tool_node", "model")
 
-graph = graph_form.compile(checkpointer=memory)
\ No newline at end of file
+_graph = None
+
+
+def get_graph():
+    """Compiled lazily, persistent checkpointers only exist once the app has started"""
+    global _graph
+    if _graph is None:
+        if researcher_checkpointer.saver is None:
+            raise RuntimeError("Researcher checkpointer is not started")
+        _graph = graph_form.compile(checkpointer=researcher_checkpointer.saver)
+    return _graph
\ No newline at end of file
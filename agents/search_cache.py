@@ -0,0 +1,139 @@
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+SEARCH_CACHE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_TTL_SECONDS", "900"))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "1024"))
+# Optional on-disk layer, shared by every worker on the host
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", "")
+SEARCH_CACHE_DISK_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_DISK_MAX_ENTRIES", "10000"))
+
+_whitespace = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    return _whitespace.sub(" ", query or "").strip().lower()
+
+
+class DiskSearchCache:
+    """sqlite file holding search results as json, only touched from worker threads"""
+
+    def __init__(self, path: str, max_entries: int = SEARCH_CACHE_DISK_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS search_cache (key TEXT PRIMARY KEY, expires_at REAL NOT NULL, results TEXT NOT NULL)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[tuple]:
+        with self._lock:
+            row = self._conn.execute("SELECT expires_at, results FROM search_cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] < time.time():
+            return None
+        return row[0], json.loads(row[1])
+
+    def set(self, key: str, expires_at: float, results: Any):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO search_cache (key, expires_at, results) VALUES (?, ?, ?)", (key, expires_at, json.dumps(results)))
+            self._conn.execute("DELETE FROM search_cache WHERE expires_at < ?", (time.time(),))
+            self._conn.execute(
+                "DELETE FROM search_cache WHERE key NOT IN (SELECT key FROM search_cache ORDER BY expires_at DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+
+class SearchCache:
+    """
+    TTL + LRU cache in front of the search tool, keyed by normalized query and max_results.
+    Identical searches running at the same time share one in-flight request (singleflight).
+    """
+
+    def __init__(self, ttl_seconds: float = SEARCH_CACHE_TTL_SECONDS, max_entries: int = SEARCH_CACHE_MAX_ENTRIES, path: str = SEARCH_CACHE_PATH):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: dict = {}
+        self._disk = DiskSearchCache(path) if path else None
+        self.hits = 0
+        self.misses = 0
+        self.collapsed = 0
+
+    @staticmethod
+    def make_key(query: str, max_results: int) -> str:
+        return json.dumps([normalize_query(query), max_results])
+
+    def _remember(self, key: str, expires_at: float, results: Any):
+        self._entries[key] = (expires_at, results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _lookup(self, key: str):
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] >= time.time():
+                self._entries.move_to_end(key)
+                return entry
+            del self._entries[key]
+
+        if self._disk is not None:
+            entry = await asyncio.to_thread(self._disk.get, key)
+            if entry is not None:
+                self._remember(key, *entry)
+                return entry
+        return None
+
+    async def _fetch(self, key: str, search: Callable[[], Awaitable[Any]]):
+        results = await search()
+        # Tavily reports failures as strings, only cache real result lists
+        if isinstance(results, list):
+            expires_at = time.time() + self.ttl_seconds
+            self._remember(key, expires_at, results)
+            if self._disk is not None:
+                await asyncio.to_thread(self._disk.set, key, expires_at, results)
+        return results
+
+    async def get_or_search(self, query: str, max_results: int, search: Callable[[], Awaitable[Any]]):
+        key = self.make_key(query, max_results)
+
+        entry = await self._lookup(key)
+        if entry is not None:
+            self.hits += 1
+            return entry[1]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            # The search runs in its own task so one caller going away doesn't cancel it for the others
+            task = asyncio.create_task(self._fetch(key, search))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._inflight.pop(key, None))
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        else:
+            self.collapsed += 1
+
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "collapsed": self.collapsed,
+        }
+
+
+search_cache = SearchCache()
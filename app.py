@@ -1,15 +1,84 @@
-from fastapi import FastAPI
+import time
+
+# Measured from here, the report at startup shows how much of a cold start is imports
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
 from starlette.middleware.sessions import SessionMiddleware
+from contextlib import asynccontextmanager
 from .routes import challenge, multi_agents, auth
+from .agents.question_pool import question_pool
+from .agents.checkpointer import researcher_checkpointer
+from .agents import researcher
+from .agents.llm_registry import llm_registry
+from .database.instrumentation import QueryStatsMiddleware
+from .database.models import init_db
+from .database.quota_store import quota_store
+from .metrics import metrics
+from .tracing import TracingMiddleware
+from .profiling import ProfilingMiddleware
+from .social_credeentials.google_oauth import get_oauth
+from .static_files import ROOT_CACHE_CONTROL, PrecompressedStaticFiles, SPAIndex
 from dotenv import load_dotenv
+import asyncio
+import inspect
 import os
 
 load_dotenv()
 
-app = FastAPI()
+IMPORT_SECONDS = time.perf_counter() - _import_started
+# Build the LLM/search/OAuth clients during startup instead of on the first request
+WARM_CLIENTS = os.getenv("WARM_CLIENTS", "false").lower() == "true"
+
+
+def warm_clients():
+    llm_registry.warm()
+    researcher.warm_clients()
+    get_oauth()
+
+
+def load_static_files():
+    # Compressing the bundle takes a while, done here instead of on the first static request
+    spa_root_files.load()
+    assets.load()
+    spa_index.load()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    timings = {"imports": IMPORT_SECONDS}
+    steps = [
+        ("schema", init_db),
+        ("checkpointer", researcher_checkpointer.start),
+        ("question_pool", question_pool.start),
+        ("quota_store", quota_store.start),
+        ("static_files", lambda: asyncio.to_thread(load_static_files)),
+    ]
+    if WARM_CLIENTS:
+        steps.append(("clients", lambda: asyncio.to_thread(warm_clients)))
+
+    for name, start in steps:
+        step_started = time.perf_counter()
+        result = start()
+        if inspect.isawaitable(result):
+            await result
+        timings[name] = time.perf_counter() - step_started
+
+    app.state.startup_timings = timings
+    print("Startup: " + ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in timings.items()))
+
+    yield
+
+    await question_pool.stop()
+    await researcher_checkpointer.stop()
+    # Write-behind counters are flushed before the process goes away
+    await quota_store.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+
 
 # ✅ Health check endpoint
 @app.get("/health", tags=["Health"])
@@ -17,6 +86,14 @@ async def health_check():
     return {"status": "ok"}
 
 
+# Prometheus text format, only served while METRICS_ENABLED is on
+@app.get("/metrics", tags=["Health"], response_class=PlainTextResponse)
+async def metrics_endpoint():
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 app.add_middleware(
     SessionMiddleware,
     secret_key=os.getenv("SESSION_SECRET_KEY")
@@ -30,19 +107,30 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
+app.add_middleware(QueryStatsMiddleware)
+
+# Outside the app middlewares so its root span covers the whole request
+app.add_middleware(TracingMiddleware)
+
+# Opt-in, PROFILING_ENABLED or a signed X-Profile header, slow requests are written to PROFILING_DIR
+app.add_middleware(ProfilingMiddleware)
+
   
 app.include_router(challenge.router, prefix="/api")
 app.include_router(multi_agents.router, prefix="/agent")
 app.include_router(auth.router)
 
 
-# ✅ Mount static files
-app.mount("/assets", StaticFiles(directory="frontend-main/dist/assets"), name="assets")
+# ✅ Mount static files, hashed assets are served precompressed with immutable caching
+assets = PrecompressedStaticFiles(directory="frontend-main/dist/assets")
+app.mount("/assets", assets, name="assets")
+spa_root_files = PrecompressedStaticFiles(directory="frontend-main/dist", cache_control=ROOT_CACHE_CONTROL, recursive=False)
+spa_index = SPAIndex("frontend-main/dist/index.html")
 
 # ✅ Catch-all route for SPA (e.g., React Router or Vue Router)
 @app.get("/{full_path:path}")
-async def serve_spa(full_path: str):
-    return FileResponse("frontend-main/dist/index.html")
-
-
-
+async def serve_spa(full_path: str, request: Request):
+    # Files next to index.html (logos, images) are served as themselves
+    if full_path != "index.html" and full_path in spa_root_files.top_level_files:
+        return await spa_root_files.get_response(full_path, request.scope)
+    return spa_index.response(request.scope)
@@ -0,0 +1,265 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+from collections import defaultdict, deque
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage, get_buffer_string
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+
+WORDS = (
+    "list dict tuple set closure generator decorator iterator lambda slice index loop recursion stack queue "
+    "heap tree graph hash string regex promise callback prototype class interface enum async await scope "
+    "hoisting binding mutation copy sort filter reduce map zip range yield context manager exception retry "
+    "buffer stream socket thread lock cache memo matrix vector bit shift modulo float integer boolean null"
+).split()
+
+_requested_count = re.compile(r"[Gg]enerate (\d+)")
+
+
+class SyntheticLatency:
+    """Seeded latency model, a base delay plus a per-token delay, both with jitter"""
+
+    def __init__(self, base: float = 0.4, per_token: float = 0.01, jitter: float = 0.2, seed: int = 7):
+        self.base = base
+        self.per_token = per_token
+        self.jitter = jitter
+        self._random = random.Random(seed)
+
+    def _scaled(self, seconds: float) -> float:
+        return max(seconds * (1 + self._random.uniform(-self.jitter, self.jitter)), 0)
+
+    async def first_token(self):
+        await asyncio.sleep(self._scaled(self.base))
+
+    async def token(self):
+        await asyncio.sleep(self._scaled(self.per_token))
+
+    async def call(self, tokens: int):
+        await asyncio.sleep(self._scaled(self.base + self.per_token * tokens))
+
+
+class Recordings:
+    """
+    Recorded LLM/search outputs in one json file.
+    Replay looks a call up by its prompt hash and falls back to the recorded order for the
+    same kind, prompts carry dates and random ids so exact matches are not guaranteed.
+    """
+
+    def __init__(self, path: Optional[str], mode: str = "off"):
+        self.path = path
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._by_kind = defaultdict(deque)
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self._entries = json.load(f)
+            for key, entry in self._entries.items():
+                self._by_kind[entry["kind"]].append(entry["payload"])
+
+    @staticmethod
+    def key(kind: str, prompt: str) -> str:
+        return hashlib.sha256(f"{kind}\n{prompt}".encode()).hexdigest()
+
+    def lookup(self, kind: str, prompt: str) -> Optional[Any]:
+        if self.mode != "replay":
+            return None
+        with self._lock:
+            entry = self._entries.get(self.key(kind, prompt))
+            if entry is not None:
+                self.hits += 1
+                return entry["payload"]
+            queue = self._by_kind.get(kind)
+            if queue:
+                # Rotate so a long run keeps cycling through what was recorded
+                payload = queue.popleft()
+                queue.append(payload)
+                self.hits += 1
+                return payload
+            self.misses += 1
+            return None
+
+    def record(self, kind: str, prompt: str, payload: Any):
+        with self._lock:
+            self._entries[self.key(kind, prompt)] = {"kind": kind, "payload": payload}
+
+    def save(self):
+        if self.mode == "record" and self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "w") as f:
+                json.dump(self._entries, f, indent=1)
+
+
+def prompt_text(messages) -> str:
+    if isinstance(messages, list):
+        return get_buffer_string(messages)
+    return str(messages)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for the Gemini client.
+    Structured output builds question sets of the requested size. Tool-bound chat first
+    asks for a search and then streams a short answer token by token, so the SSE route
+    produces the same event sequence it does in production.
+    """
+
+    latency: Any = None
+    recordings: Any = None
+    seed: int = 7
+    tools_bound: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "benchmark-fake"
+
+    def _answer(self, messages) -> AIMessage:
+        if self.recordings is not None:
+            recorded = self.recordings.lookup("chat", prompt_text(messages))
+            if recorded is not None:
+                return AIMessage(content=recorded["content"], tool_calls=recorded.get("tool_calls", []))
+
+        if not self.tools_bound or (messages and isinstance(messages[-1], ToolMessage)):
+            words = random.Random(len(messages)).choices(WORDS, k=60)
+            return AIMessage(content=" ".join(words) + ".")
+
+        question = messages[-1].content if messages else ""
+        return AIMessage(content="", tool_calls=[{"name": "tavily_search_results_json", "args": {"query": str(question)[:80]}, "id": f"call_{len(messages)}"}])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=self._answer(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self._answer(messages)
+        await self.latency.call(len(str(message.content).split()))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._answer(messages)
+        await self.latency.first_token()
+        if message.tool_calls:
+            chunks = [{"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": index} for index, call in enumerate(message.tool_calls)]
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=chunks))
+            return
+
+        for word in str(message.content).split(" "):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+            await self.latency.token()
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={"tools_bound": True})
+
+    def with_structured_output(self, schema, **kwargs):
+        counter = iter(range(10**9))
+        # Seeded per schema so the shard and single-call outputs don't repeat each other
+        rng = random.Random(f"{self.seed}:{schema.__name__}")
+        lock = threading.Lock()
+        min_questions = schema.model_json_schema()["properties"]["questions"].get("minItems", 1)
+
+        async def generate(messages):
+            prompt = prompt_text(messages)
+            if self.recordings is not None:
+                recorded = self.recordings.lookup(f"structured:{schema.__name__}", prompt)
+                if recorded is not None:
+                    await self.latency.call(len(json.dumps(recorded)) // 4)
+                    return schema.model_validate(recorded)
+
+            counts = [int(count) for count in _requested_count.findall(prompt)]
+            count = max(min(counts[-1] if counts else 5, 12), min_questions)
+            questions = []
+            with lock:
+                for _ in range(count):
+                    words = " ".join(rng.sample(WORDS, 8))
+                    questions.append({
+                        "title": f"{schema.__name__} {next(counter)}: what happens with {words}?",
+                        "options": [rng.choice(WORDS) for _ in range(4)],
+                        "correct_answer_id": rng.randrange(4),
+                        "explanation": " ".join(rng.sample(WORDS, 12)),
+                    })
+            await self.latency.call(80 * count)
+            return schema.model_validate({"questions": questions})
+
+        return RunnableLambda(generate, name=f"fake_structured_{schema.__name__}")
+
+
+class RecordingClient:
+    """Wraps a real client, passing calls through and saving their outputs for replay"""
+
+    def __init__(self, client, recordings: Recordings):
+        self.client = client
+        self.recordings = recordings
+
+    def with_structured_output(self, schema, **kwargs):
+        runnable = self.client.with_structured_output(schema, **kwargs)
+
+        async def call(messages, config):
+            result = await runnable.ainvoke(messages, config)
+            self.recordings.record(f"structured:{schema.__name__}", prompt_text(messages), result.model_dump())
+            return result
+
+        return RunnableLambda(call)
+
+    def _recorded_chat(self, runnable):
+        async def call(messages, config):
+            result = await runnable.ainvoke(messages, config)
+            self.recordings.record("chat", prompt_text(messages), {"content": result.content, "tool_calls": result.tool_calls})
+            return result
+
+        return RunnableLambda(call)
+
+    def bind_tools(self, tools, **kwargs):
+        return self._recorded_chat(self.client.bind_tools(tools=tools, **kwargs))
+
+    async def ainvoke(self, messages, config=None, **kwargs):
+        return await self._recorded_chat(self.client).ainvoke(messages, config)
+
+
+class FakeSearch:
+    """Search tool with synthetic latency, replaying recorded results when there are some"""
+
+    name = "tavily_search_results_json"
+
+    def __init__(self, latency: SyntheticLatency, recordings: Optional[Recordings] = None, max_results: int = 4):
+        self.latency = latency
+        self.recordings = recordings
+        self.max_results = max_results
+        self.calls = 0
+
+    async def ainvoke(self, args: dict) -> List[dict]:
+        self.calls += 1
+        query = args.get("query", "")
+        await self.latency.call(0)
+        if self.recordings is not None:
+            recorded = self.recordings.lookup("search", query)
+            if recorded is not None:
+                return recorded
+        slug = re.sub(r"\W+", "-", query.lower()).strip("-") or "query"
+        return [{"url": f"https://example.com/{slug}/{index}", "content": " ".join(WORDS[index:index + 40])} for index in range(self.max_results)]
+
+
+class RecordingSearch:
+    name = "tavily_search_results_json"
+
+    def __init__(self, tool, recordings: Recordings):
+        self.tool = tool
+        self.recordings = recordings
+        self.max_results = tool.max_results
+
+    async def ainvoke(self, args: dict):
+        results = await self.tool.ainvoke(args)
+        if isinstance(results, list):
+            self.recordings.record("search", args.get("query", ""), results)
+        return results
@@ -0,0 +1,302 @@
+"""
+Offline end-to-end benchmark: the real app on uvicorn against SQLite, with the LLM and
+search replaced by fakes (synthetic latency, optional record/replay), driven by concurrent
+virtual users. Run from the directory above the package:
+
+    python -m <package>.benchmarks.run --users 20 --iterations 5 --out after.json
+    python -m <package>.benchmarks.run --compare before.json after.json
+
+Relative result and recording paths land in benchmarks/results/, which is gitignored.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Optional
+
+
+SCENARIOS = ("auth", "generate", "generate_stream", "researcher")
+PACKAGE = __package__.rpartition(".")[0]
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+
+
+def results_path(path: str) -> str:
+    # Absolute paths are kept as they are
+    return os.path.join(RESULTS_DIR, path)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--iterations", type=int, default=3, help="scenario rounds per user")
+    parser.add_argument("--scenarios", default="auth,generate,researcher", help=f"comma separated, from {', '.join(SCENARIOS)}")
+    parser.add_argument("--latency", type=float, default=0.4, help="fake LLM/search base latency in seconds")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="fake LLM delay per token in seconds")
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative latency jitter")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--llm", choices=("fake", "record", "replay"), default="fake", help="record needs real GOOGLE_API_KEY/TAVILY_API_KEY")
+    parser.add_argument("--recordings", default="recordings.json")
+    parser.add_argument("--bcrypt-rounds", type=int, default=None, help="defaults to the app's BCRYPT_ROUNDS")
+    parser.add_argument("--database", default=None, help="sqlite file, a fresh temporary one by default")
+    parser.add_argument("--out", default=None, help="write the results json here, relative to benchmarks/results/")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two results files and exit")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args):
+    """Has to run before the app is imported, the modules read their settings at import"""
+    # The app serves the SPA from paths relative to the repo
+    os.chdir(REPO_DIR)
+    database = args.database or os.path.join(tempfile.mkdtemp(prefix="bench-"), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    if args.bcrypt_rounds:
+        os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    for key, value in {
+        "AUTH_SECRET_KEY": "benchmark-secret",
+        "AUTH_ALGORITHM": "HS256",
+        "SESSION_SECRET_KEY": "benchmark-session",
+        "GOOGLE_API_KEY": "benchmark",
+        "TAVILY_API_KEY": "benchmark",
+    }.items():
+        if args.llm != "record" or key not in ("GOOGLE_API_KEY", "TAVILY_API_KEY"):
+            os.environ.setdefault(key, value)
+
+
+def install_fakes(args) -> dict:
+    fakes = importlib.import_module(f"{PACKAGE}.benchmarks.fakes")
+    registry = importlib.import_module(f"{PACKAGE}.agents.llm_registry")
+    researcher = importlib.import_module(f"{PACKAGE}.agents.researcher")
+    quota_db = importlib.import_module(f"{PACKAGE}.database.db")
+
+    recordings = fakes.Recordings(results_path(args.recordings), mode=args.llm if args.llm != "fake" else "off")
+    latency = fakes.SyntheticLatency(args.latency, args.token_latency, args.jitter, args.seed)
+
+    for model in set(registry.llm_registry.role_models.values()):
+        if args.llm == "record":
+            client = fakes.RecordingClient(registry.gemini_client(model), recordings)
+        else:
+            client = fakes.FakeChatModel(latency=latency, recordings=recordings, seed=args.seed)
+        registry.llm_registry.set_client(model, client)
+
+    if args.llm == "record":
+        search = fakes.RecordingSearch(researcher.get_search_tool(), recordings)
+    else:
+        search = fakes.FakeSearch(latency, recordings)
+    researcher.get_search_tool = lambda: search
+
+    # Virtual users run far more generations than a day's quota allows
+    quota_db.DAILY_QUOTA = 10**9
+    return {"recordings": recordings, "search": search}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_server(app, port: int):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+class Samples:
+    def __init__(self):
+        self.by_endpoint = defaultdict(list)
+
+    def add(self, endpoint: str, ok: bool, latency: float, ttfb: Optional[float], ttft: Optional[float] = None):
+        self.by_endpoint[endpoint].append({"ok": ok, "latency": latency, "ttfb": ttfb, "ttft": ttft})
+
+
+async def timed_request(client, samples: Samples, endpoint: str, method: str, url: str, sse: bool = False, **kwargs):
+    """Streams the response so time to first byte and, for SSE, first content token are seen"""
+    started = time.perf_counter()
+    ttfb = ttft = None
+    body = b""
+    try:
+        async with client.stream(method, url, **kwargs) as response:
+            async for chunk in response.aiter_bytes():
+                now = time.perf_counter()
+                if ttfb is None:
+                    ttfb = now - started
+                if sse and ttft is None and (b'"type": "content"' in chunk or b'"type": "question"' in chunk):
+                    ttft = now - started
+                body += chunk if len(body) < 65536 else b""
+            ok = response.status_code < 400 and b'"type": "error"' not in body
+    except Exception as e:
+        print(f"{endpoint} failed: {str(e)}")
+        ok = False
+    samples.add(endpoint, ok, time.perf_counter() - started, ttfb, ttft)
+    return body
+
+
+async def virtual_user(index: int, base_url: str, args, scenarios: list, samples: Samples, run_id: str):
+    import httpx
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        credentials = {"email": f"bench-{run_id}-{index}@example.com", "password": f"password-{index}"}
+        await timed_request(client, samples, "POST /auth/ (signup)", "POST", "/auth/", json=credentials)
+
+        for iteration in range(args.iterations):
+            settings = {"difficulty": ("easy", "medium", "hard")[(index + iteration) % 3], "programmingLanguage": ("python", "javascript")[index % 2]}
+            for scenario in scenarios:
+                if scenario == "auth":
+                    await timed_request(client, samples, "POST /auth/token", "POST", "/auth/token", json=credentials)
+                    await timed_request(client, samples, "GET /auth/user", "GET", "/auth/user")
+                elif scenario == "generate":
+                    await timed_request(client, samples, "POST /api/generate-challenge", "POST", "/api/generate-challenge", json=settings)
+                elif scenario == "generate_stream":
+                    await timed_request(client, samples, "POST /api/generate-challenge/stream", "POST", "/api/generate-challenge/stream", sse=True, json=settings)
+                elif scenario == "researcher":
+                    await timed_request(client, samples, "GET /agent/researcher", "GET", "/agent/researcher", sse=True, params={"message": f"What changed in {settings['programmingLanguage']} release {iteration}?"})
+
+
+def percentile(values: list, p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(p / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def distribution_ms(values: list) -> Optional[dict]:
+    values = [value * 1000 for value in values if value is not None]
+    if not values:
+        return None
+    return {
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "mean": round(sum(values) / len(values), 2),
+        "max": round(max(values), 2),
+    }
+
+
+def summarize(samples: Samples, elapsed: float) -> dict:
+    endpoints = {}
+    for endpoint, rows in sorted(samples.by_endpoint.items()):
+        endpoints[endpoint] = {
+            "count": len(rows),
+            "errors": sum(1 for row in rows if not row["ok"]),
+            "throughput_rps": round(len(rows) / elapsed, 3),
+            "latency_ms": distribution_ms([row["latency"] for row in rows]),
+            "ttfb_ms": distribution_ms([row["ttfb"] for row in rows]),
+            "ttft_ms": distribution_ms([row["ttft"] for row in rows]),
+        }
+    total = sum(len(rows) for rows in samples.by_endpoint.values())
+    return {"elapsed_s": round(elapsed, 3), "requests": total, "throughput_rps": round(total / elapsed, 3), "endpoints": endpoints}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+async def run(args) -> dict:
+    configure_environment(args)
+    fakes = install_fakes(args)
+    app = importlib.import_module(f"{PACKAGE}.app").app
+
+    scenarios = [scenario.strip() for scenario in args.scenarios.split(",") if scenario.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    port = free_port()
+    server, task = await start_server(app, port)
+    samples = Samples()
+    run_id = uuid.uuid4().hex[:8]
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(virtual_user(index, f"http://127.0.0.1:{port}", args, scenarios, samples, run_id) for index in range(args.users)))
+    finally:
+        elapsed = time.perf_counter() - started
+        server.should_exit = True
+        await task
+        fakes["recordings"].save()
+
+    config = {key: value for key, value in vars(args).items() if key not in ("out", "compare")}
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "config": config,
+        },
+        "recordings": {"hits": fakes["recordings"].hits, "misses": fakes["recordings"].misses},
+        "search_calls": fakes["search"].calls if hasattr(fakes["search"], "calls") else None,
+        **summarize(samples, elapsed),
+    }
+
+
+def print_summary(results: dict):
+    print(f"{results['requests']} requests in {results['elapsed_s']}s, {results['throughput_rps']} req/s")
+    print(f"{'endpoint':40} {'n':>5} {'err':>4} {'p50':>9} {'p95':>9} {'p99':>9} {'ttfb50':>9} {'ttft50':>9}")
+    for endpoint, stats in results["endpoints"].items():
+        latency = stats["latency_ms"] or {}
+        ttfb = stats["ttfb_ms"] or {}
+        ttft = stats["ttft_ms"] or {}
+        print(f"{endpoint:40} {stats['count']:>5} {stats['errors']:>4} {latency.get('p50', '-'):>9} {latency.get('p95', '-'):>9} {latency.get('p99', '-'):>9} {ttfb.get('p50', '-'):>9} {ttft.get('p50', '-'):>9}")
+
+
+def compare(before_path: str, after_path: str):
+    with open(results_path(before_path)) as f:
+        before = json.load(f)
+    with open(results_path(after_path)) as f:
+        after = json.load(f)
+
+    def change(old, new):
+        if old in (None, 0) or new is None:
+            return "-"
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    print(f"throughput {before['throughput_rps']} -> {after['throughput_rps']} req/s ({change(before['throughput_rps'], after['throughput_rps'])})")
+    print(f"{'endpoint':40} {'metric':8} {'before':>10} {'after':>10} {'change':>8}")
+    for endpoint in sorted(set(before["endpoints"]) | set(after["endpoints"])):
+        old_stats = before["endpoints"].get(endpoint, {})
+        new_stats = after["endpoints"].get(endpoint, {})
+        for metric in ("p50", "p95", "p99"):
+            old = (old_stats.get("latency_ms") or {}).get(metric)
+            new = (new_stats.get("latency_ms") or {}).get(metric)
+            print(f"{endpoint:40} {metric:8} {str(old):>10} {str(new):>10} {change(old, new):>8}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = asyncio.run(run(args))
+    print_summary(results)
+    if args.out:
+        out = results_path(args.out)
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+        with open(out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
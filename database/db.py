@@ -1,59 +1,125 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import case, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
+from typing import Optional
 from . import models
-from ..routes.auth import GetUser
+from ..tracing import traced
 
 
-def get_challenge_quota(db: Session, user_id: str):
-    return (db.query(models.ChallengeQuota)
-            .filter(models.ChallengeQuota.user_id == user_id)
-            .first())
+DAILY_QUOTA = 50
+HISTORY_SAVE_CHUNK_SIZE = 500
+QUOTA_RESET_INTERVAL = timedelta(hours=24)
+# Default min_remaining, the quota left has to cover the whole amount being charged
+COVER_AMOUNT = object()
 
 
-def create_challenge_quota(db: Session, user_id: str):
+def dialect_insert(db: AsyncSession):
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert
+    if dialect == "sqlite":
+        return sqlite.insert
+    raise RuntimeError(f"Unsupported database for upserts: {dialect}")
 
-    user = db.query(models.User).filter_by(id = user_id).first()
-    db_quota = models.ChallengeQuota(user=user)
-    db.add(db_quota)
-    db.commit()
-    db.refresh(db_quota)
-    return db_quota
 
+@traced("db.aupsert_challenges")
+async def aupsert_challenges(db: AsyncSession, user_id: int, challenges: list, chunk_size: int = HISTORY_SAVE_CHUNK_SIZE):
+    """
+    Saves answered challenges in multi-row INSERT ... ON CONFLICT (question_id) DO UPDATE statements.
+    Re-submitting a question updates it instead of failing the batch, but only if it
+    belongs to the same user. Everything commits together, so a retry is safe.
+    """
+    table = models.Challenge.__table__
+    # A statement can't touch the same row twice, the last answer for a question wins
+    rows = list({row["question_id"]: {**row, "user_id": user_id} for row in challenges}.values())
+    insert = dialect_insert(db)
 
-def reset_quota_if_needed(db: Session, quota: models.ChallengeQuota):
+    for start in range(0, len(rows), chunk_size):
+        stmt = insert(table).values(rows[start:start + chunk_size])
+        updated_columns = ("difficulty", "programming_language", "title", "options", "correct_answer_id", "user_answer", "explanation")
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.question_id],
+            set_={column: stmt.excluded[column] for column in updated_columns},
+            where=table.c.user_id == stmt.excluded.user_id,
+        )
+        await db.execute(stmt)
+
+    await db.commit()
+    return len(rows)
+
+
+def user_challenges_query(user_id: int, programming_language: Optional[str] = None, difficulty: Optional[str] = None, correct: Optional[bool] = None):
+    """Columns only, newest first with id as the tie breaker, the order the history cursor relies on"""
+    challenges = models.Challenge.__table__
+    stmt = select(*challenges.c).where(challenges.c.user_id == user_id)
+    if programming_language:
+        stmt = stmt.where(challenges.c.programming_language == programming_language)
+    if difficulty:
+        stmt = stmt.where(challenges.c.difficulty == difficulty)
+    if correct is True:
+        stmt = stmt.where(challenges.c.user_answer == challenges.c.correct_answer_id)
+    elif correct is False:
+        stmt = stmt.where((challenges.c.user_answer.is_(None)) | (challenges.c.user_answer != challenges.c.correct_answer_id))
+    return stmt.order_by(challenges.c.date_created.desc(), challenges.c.id.desc())
+
+
+@traced("db.aget_user_challenges_page")
+async def aget_user_challenges_page(db: AsyncSession, user_id: int, limit: int, after: Optional[tuple] = None, **filters):
+    """One keyset page, after is the (date_created, id) of the last row already seen"""
+    challenges = models.Challenge.__table__
+    stmt = user_challenges_query(user_id, **filters)
+    if after is not None:
+        stmt = stmt.where(tuple_(challenges.c.date_created, challenges.c.id) < tuple_(*after))
+    result = await db.execute(stmt.limit(limit))
+    return [dict(row) for row in result.mappings()]
+
+
+# Quota admission in one statement: creates the row, applies the daily reset,
+# checks what's left and charges it atomically, so concurrent requests can't oversubscribe
+
+@traced("db.consume_quota")
+async def consume_quota(db: AsyncSession, user_id: int, amount: int = 1, min_remaining: Optional[int] = COVER_AMOUNT):
+    """
+    Charges amount against the user's quota when at least min_remaining (by default amount) is left after the lazy reset.
+    Returns the updated quota as a dict, or None when there isn't enough left.
+    amount=0 with min_remaining=None just reads the quota, reset applied.
+    """
+    if min_remaining is COVER_AMOUNT:
+        min_remaining = amount
+    quotas = models.ChallengeQuota.__table__
     now = datetime.now()
+    is_stale = quotas.c.last_reset_date < now - QUOTA_RESET_INTERVAL
+    current = case((is_stale, DAILY_QUOTA), else_=quotas.c.quota_remaining)
 
-    if now - quota.last_reset_date > timedelta(hours=24):
-        quota.quota_remaining = 50
-        quota.last_reset_date = now
-        db.add(quota)
-        db.commit()
-        db.refresh(quota)
-    return quota
-
-
-def create_challenge(
-    db: Session,
-    difficulty: str,
-    created_by: str,
-    title: str,
-    options: str,
-    correct_answer_id: int,
-    explanation: str
-):
-    db_challenge = models.Challenge(
-        difficulty=difficulty,
-        created_by=created_by,
-        title=title,
-        options=options,
-        correct_answer_id=correct_answer_id,
-        explanation=explanation
-    )
-    db.add(db_challenge)
-    db.commit()
-    db.refresh(db_challenge)
-    return db_challenge
+    insert = dialect_insert(db)
 
+    stmt = insert(quotas).values(user_id=user_id, quota_remaining=DAILY_QUOTA - amount, last_reset_date=now)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[quotas.c.user_id],
+        set_={
+            "quota_remaining": current - amount,
+            "last_reset_date": case((is_stale, now), else_=quotas.c.last_reset_date),
+        },
+        where=(current >= min_remaining) if min_remaining is not None else None,
+    ).returning(quotas.c.id, quotas.c.user_id, quotas.c.quota_remaining, quotas.c.last_reset_date)
 
-def get_user_challenges(db: Session, user_id: str):
-    return db.query(models.Challenge).filter(models.Challenge.created_by == user_id).all()
+    result = await db.execute(stmt)
+    quota = result.mappings().first()
+    await db.commit()
+    return dict(quota) if quota else None
+
+
+@traced("db.refund_quota")
+async def refund_quota(db: AsyncSession, user_id: int, amount: int):
+    """Gives back quota that was reserved by consume_quota but not delivered"""
+    quotas = models.ChallengeQuota.__table__
+    result = await db.execute(
+        update(quotas)
+        .where(quotas.c.user_id == user_id)
+        .values(quota_remaining=quotas.c.quota_remaining + max(amount, 0))
+        .returning(quotas.c.quota_remaining)
+    )
+    quota_remaining = result.scalar()
+    await db.commit()
+    return quota_remaining
@@ -0,0 +1,213 @@
+from collections import Counter
+from contextvars import ContextVar
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from types import SimpleNamespace
+from typing import Optional
+import functools
+import os
+import time
+
+
+load_dotenv()
+
+# Statement counts/timings per request through engine events, off by default
+DB_INSTRUMENTATION = os.getenv("DB_INSTRUMENTATION", "false").lower() == "true"
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+# The same SELECT this many times in one request gets flagged as a likely N+1
+DB_N_PLUS_ONE_THRESHOLD = int(os.getenv("DB_N_PLUS_ONE_THRESHOLD", "5"))
+# X-DB-* response headers with the request's totals, meant for local debugging
+DB_DEBUG_HEADERS = os.getenv("DB_DEBUG_HEADERS", "false").lower() == "true"
+STATEMENT_LOG_CHARS = 300
+REDACTED_PARAMS_SHOWN = 20
+
+@functools.lru_cache(maxsize=None)
+def instruments() -> SimpleNamespace:
+    """
+    Built on first use, migration/env.py imports database.models as a top-level package
+    where the app's metrics/tracing modules can't be reached relatively.
+    """
+    from ..metrics import metrics
+    from ..tracing import current_span
+    return SimpleNamespace(
+        current_span=current_span,
+        statement_seconds=metrics.histogram("db_statement_seconds", "Execution time per SQL statement", ("operation",)),
+        slow_statements=metrics.counter("db_slow_statements_total", "Statements slower than DB_SLOW_QUERY_MS", ("operation",)),
+        pool_wait_seconds=metrics.histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection"),
+        request_statements=metrics.histogram("db_request_statements", "SQL statements issued per request", ("route",), buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)),
+        request_db_seconds=metrics.histogram("db_request_seconds", "Total statement time per request", ("route",)),
+        request_commits=metrics.histogram("db_request_commits", "Commits per request", ("route",), buckets=(0, 1, 2, 3, 5, 8, 13)),
+        n_plus_one=metrics.counter("db_n_plus_one_total", "Requests that repeated one SELECT at least DB_N_PLUS_ONE_THRESHOLD times", ("route",)),
+    )
+
+
+class QueryStats:
+    """Totals for one request, shared by every task and thread started inside it"""
+
+    __slots__ = ("statements", "seconds", "commits", "pool_wait", "selects")
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+        self.commits = 0
+        self.pool_wait = 0.0
+        self.selects = Counter()
+
+    def repeated_selects(self, threshold: int = DB_N_PLUS_ONE_THRESHOLD) -> list:
+        return [(statement, count) for statement, count in self.selects.most_common() if count >= threshold]
+
+
+query_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def operation(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+
+
+def redact(parameters, executemany: bool = False) -> str:
+    """Keeps the shape of the bound parameters and drops the values, emails and hashes stay out of the logs"""
+    if executemany and isinstance(parameters, (list, tuple)):
+        return f"{len(parameters)} rows of {redact(parameters[0]) if parameters else '()'}"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        if len(parameters) > REDACTED_PARAMS_SHOWN:
+            return f"({len(parameters)} params)"
+        return "(" + ", ".join(type(value).__name__ for value in parameters) + ")"
+    return type(parameters).__name__
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    kind = operation(statement)
+    instruments().statement_seconds.observe(elapsed, operation=kind)
+
+    stats = query_stats.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.seconds += elapsed
+        if kind == "SELECT":
+            stats.selects[statement] += 1
+
+    if elapsed * 1000 >= DB_SLOW_QUERY_MS:
+        instruments().slow_statements.inc(operation=kind)
+        print(f"Slow query {elapsed * 1000:.0f}ms: {' '.join(statement.split())[:STATEMENT_LOG_CHARS]} params={redact(parameters, executemany)}")
+
+
+def handle_error(exception_context):
+    started = exception_context.connection.info.get("query_started") if exception_context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def on_commit(conn):
+    stats = query_stats.get()
+    if stats is not None:
+        stats.commits += 1
+
+
+def instrument_engine(engine):
+    """Listens on a sync engine, pass async_engine.sync_engine for the async one"""
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+    event.listen(engine, "commit", on_commit)
+
+
+def record_pool_wait(seconds: float):
+    instruments().pool_wait_seconds.observe(seconds)
+    stats = query_stats.get()
+    if stats is not None:
+        stats.pool_wait += seconds
+
+
+def timed_pool_class(url):
+    """
+    The dialect's default pool with checkout timing, pool events only fire once a
+    connection has been handed out, so the wait is measured around _do_get instead.
+    """
+    url = make_url(url)
+    base = url.get_dialect().get_pool_class(url)
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return base._do_get(self)
+        finally:
+            record_pool_wait(time.perf_counter() - started)
+
+    return type(f"Timed{base.__name__}", (base,), {"_do_get": _do_get})
+
+
+def instrumented_pool_options(url) -> dict:
+    return {"poolclass": timed_pool_class(url)} if DB_INSTRUMENTATION else {}
+
+
+def report(stats: QueryStats, route: str):
+    recorded = instruments()
+    recorded.request_statements.observe(stats.statements, route=route)
+    recorded.request_db_seconds.observe(stats.seconds, route=route)
+    recorded.request_commits.observe(stats.commits, route=route)
+
+    repeated = stats.repeated_selects()
+    if repeated:
+        recorded.n_plus_one.inc(route=route)
+        statement, count = repeated[0]
+        print(f"Possible N+1 on {route}: {count}x {' '.join(statement.split())[:STATEMENT_LOG_CHARS]}")
+
+
+def totals_headers(stats: QueryStats) -> list:
+    headers = [
+        (b"x-db-queries", str(stats.statements).encode()),
+        (b"x-db-time-ms", f"{stats.seconds * 1000:.1f}".encode()),
+        (b"x-db-commits", str(stats.commits).encode()),
+        (b"x-db-pool-wait-ms", f"{stats.pool_wait * 1000:.1f}".encode()),
+    ]
+    repeated = stats.repeated_selects()
+    if repeated:
+        headers.append((b"x-db-n-plus-one", str(len(repeated)).encode()))
+    return headers
+
+
+class QueryStatsMiddleware:
+    """
+    Pure ASGI, collects the statements of one request.
+    Headers go out with the response start, so on a streaming response they only
+    cover the work done before the first chunk, the metrics cover the whole request.
+    """
+
+    def __init__(self, app, debug_headers: bool = DB_DEBUG_HEADERS):
+        self.app = app
+        self.debug_headers = debug_headers
+        # Registers the db metrics with the app so /metrics lists them before the first query
+        instruments()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not DB_INSTRUMENTATION:
+            return await self.app(scope, receive, send)
+
+        stats = QueryStats()
+        token = query_stats.set(stats)
+
+        async def send_with_totals(message):
+            if message["type"] == "http.response.start" and self.debug_headers:
+                message["headers"] = list(message.get("headers", [])) + totals_headers(stats)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_totals)
+        finally:
+            query_stats.reset(token)
+            route = scope.get("route")
+            report(stats, getattr(route, "path", None) or "unmatched")
+            # Lands on the request's root span when the request is traced
+            span = instruments().current_span.get()
+            if span is not None:
+                span.set_attribute("db.statements", stats.statements)
+                span.set_attribute("db.time_ms", round(stats.seconds * 1000, 3))
+                span.set_attribute("db.commits", stats.commits)
@@ -1,11 +1,14 @@
-from sqlalchemy import Boolean, Column, Integer, String, DateTime, create_engine, ForeignKey
+from sqlalchemy import Boolean, Column, Integer, String, DateTime, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from fastapi import Depends
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship, Session
+from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 from typing import Annotated
 from dotenv import load_dotenv
 import os
+from .instrumentation import DB_INSTRUMENTATION, instrument_engine, instrumented_pool_options
 
 
 load_dotenv()
@@ -14,11 +17,52 @@ db_url = os.getenv("DATABASE_URL")
 if db_url is None:
     print("No db url found")
 
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+# Turn off where the schema is managed by alembic alone
+DB_CREATE_ALL = os.getenv("DB_CREATE_ALL", "true").lower() == "true"
+
+
+def async_database_url(url: str):
+    """Swaps the sync driver for its async counterpart, asyncpg for postgres and aiosqlite for sqlite"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+
+    if backend == "postgresql":
+        query = dict(url.query)
+        # asyncpg doesn't understand libpq's sslmode
+        if "sslmode" in query:
+            query["ssl"] = query.pop("sslmode")
+        return url.set(drivername="postgresql+asyncpg", query=query)
+    if backend == "sqlite":
+        return url.set(drivername="sqlite+aiosqlite")
+    return url
+
+
+def pool_options(url) -> dict:
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+
     
-engine = create_engine(db_url, echo=False, pool_pre_ping=True, pool_recycle=3600  # optional: recycle after 1 hour
-)
+async_engine = create_async_engine(async_database_url(db_url), echo=False, pool_pre_ping=True, **pool_options(db_url), **instrumented_pool_options(async_database_url(db_url)))
+
+if DB_INSTRUMENTATION:
+    instrument_engine(async_engine.sync_engine)
 Base = declarative_base()
 
+
+def utc_now() -> datetime:
+    # Naive UTC, the columns are TIMESTAMP WITHOUT TIME ZONE and asyncpg rejects aware values for them
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
     
 class User(Base):
     __tablename__ = "users"
@@ -38,11 +82,13 @@ class User(Base):
 
 class Challenge(Base):
     __tablename__ = 'challenges'
+    # Covers the per user/language/difficulty title lookups, newest first
+    __table_args__ = (Index("ix_challenges_user_language_difficulty_created", "user_id", "programming_language", "difficulty", "date_created"),)
 
     id = Column(Integer, primary_key=True)
     difficulty = Column(String, nullable=False)
     programming_language = Column(String, nullable=False)
-    date_created = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    date_created = Column(DateTime, default=utc_now)
     title = Column(String, nullable=False)
     options = Column(String, nullable=False)
     correct_answer_id = Column(Integer, nullable=False)
@@ -56,24 +102,27 @@ class Challenge(Base):
 
 class ChallengeQuota(Base):
     __tablename__ = 'challenge_quotas'
+    # One row per user, the quota upsert conflicts on it
+    __table_args__ = (UniqueConstraint("user_id", name="uq_challenge_quotas_user_id"),)
 
     id = Column(Integer, primary_key=True)
     quota_remaining = Column(Integer, nullable=False, default=50)
-    last_reset_date = Column(DateTime, default=datetime.now(timezone.utc))
+    last_reset_date = Column(DateTime, default=utc_now)
 
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     user = relationship("User", back_populates="challenge_quotas")
 
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
 
-Base.metadata.create_all(engine)
-
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async def init_db():
+    """Creates missing tables, run from the app lifespan rather than at import"""
+    if not DB_CREATE_ALL:
+        return
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_async_db)]
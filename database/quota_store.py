@@ -0,0 +1,246 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import bindparam, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import db as quota_db
+from . import models
+from ..tracing import tracer
+
+
+load_dotenv()
+
+# strict: every check is one atomic statement against the db
+# write_behind: counters live in process and are flushed to the db in batches
+QUOTA_BACKEND = os.getenv("QUOTA_BACKEND", "strict").lower()
+QUOTA_SHARDS = int(os.getenv("QUOTA_SHARDS", "16"))
+QUOTA_FLUSH_INTERVAL = float(os.getenv("QUOTA_FLUSH_INTERVAL", "5"))
+# Flush early once this many users have unflushed changes
+QUOTA_FLUSH_THRESHOLD = int(os.getenv("QUOTA_FLUSH_THRESHOLD", "200"))
+# Idle counters are dropped after this long and reloaded from the db on next use
+QUOTA_IDLE_SECONDS = float(os.getenv("QUOTA_IDLE_SECONDS", "300"))
+QUOTA_MAX_USERS = int(os.getenv("QUOTA_MAX_USERS", "50000"))
+
+
+class QuotaCounter:
+    __slots__ = ("id", "user_id", "remaining", "last_reset_date", "pending", "reset_pending", "last_used")
+
+    def __init__(self, row: dict):
+        self.id = row["id"]
+        self.user_id = row["user_id"]
+        self.remaining = row["quota_remaining"]
+        self.last_reset_date = row["last_reset_date"]
+        # quota used since the last flush, negative when refunds outweigh charges
+        self.pending = 0
+        # the daily reset happened in memory, the next flush writes the absolute value
+        self.reset_pending = False
+        self.last_used = time.monotonic()
+
+    def as_dict(self) -> dict:
+        return {"id": self.id, "user_id": self.user_id, "quota_remaining": self.remaining, "last_reset_date": self.last_reset_date}
+
+
+class WriteBehindQuotaStore:
+    """
+    Per-user quota counters sharded by user id. Checks and charges don't touch the db,
+    a background task flushes the accumulated changes in batched UPDATEs.
+    A counter is loaded through the strict upsert on first use, so the row always exists.
+    Each worker process keeps its own counters, so the limit is only exact per process
+    until the next flush and reload.
+    """
+
+    def __init__(self, shards: int = QUOTA_SHARDS):
+        self._shards = [{} for _ in range(max(shards, 1))]
+        self._locks = [asyncio.Lock() for _ in range(max(shards, 1))]
+        self._dirty = set()
+        self._flush_now = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+        self.loads = 0
+        self.flushes = 0
+
+    def _shard(self, user_id: int) -> int:
+        return user_id % len(self._shards)
+
+    async def _counter(self, db: AsyncSession, user_id: int) -> QuotaCounter:
+        index = self._shard(user_id)
+        counter = self._shards[index].get(user_id)
+        if counter is None:
+            # Only requests for the same shard wait on a load
+            async with self._locks[index]:
+                counter = self._shards[index].get(user_id)
+                if counter is None:
+                    counter = QuotaCounter(await quota_db.consume_quota(db, user_id, amount=0, min_remaining=None))
+                    self._shards[index][user_id] = counter
+                    self.loads += 1
+
+        now = datetime.now()
+        if now - counter.last_reset_date > quota_db.QUOTA_RESET_INTERVAL:
+            counter.remaining = quota_db.DAILY_QUOTA
+            counter.last_reset_date = now
+            counter.pending = 0
+            counter.reset_pending = True
+            self._mark_dirty(user_id)
+
+        counter.last_used = time.monotonic()
+        return counter
+
+    def _mark_dirty(self, user_id: int):
+        self._dirty.add(user_id)
+        if len(self._dirty) >= QUOTA_FLUSH_THRESHOLD:
+            self._flush_now.set()
+
+    async def consume(self, db: AsyncSession, user_id: int, amount: int = 1, min_remaining: Optional[int] = quota_db.COVER_AMOUNT):
+        counter = await self._counter(db, user_id)
+        if min_remaining is quota_db.COVER_AMOUNT:
+            min_remaining = amount
+        if min_remaining is not None and counter.remaining < min_remaining:
+            return None
+        if amount:
+            counter.remaining -= amount
+            counter.pending += amount
+            self._mark_dirty(user_id)
+        return counter.as_dict()
+
+    async def refund(self, db: AsyncSession, user_id: int, amount: int):
+        counter = await self._counter(db, user_id)
+        if amount > 0:
+            counter.remaining += amount
+            counter.pending -= amount
+            self._mark_dirty(user_id)
+        return counter.remaining
+
+    async def flush(self) -> int:
+        """Writes the pending changes, returns how many users were flushed"""
+        if not self._dirty:
+            self._evict_idle()
+            return 0
+
+        dirty, self._dirty = self._dirty, set()
+        deltas, resets = [], []
+        taken = []
+        for user_id in dirty:
+            counter = self._shards[self._shard(user_id)].get(user_id)
+            if counter is None:
+                continue
+            if counter.reset_pending:
+                resets.append({"uid": user_id, "remaining": counter.remaining, "reset_date": counter.last_reset_date})
+            elif counter.pending:
+                deltas.append({"uid": user_id, "delta": counter.pending})
+            taken.append((counter, counter.pending, counter.reset_pending))
+            counter.pending = 0
+            counter.reset_pending = False
+
+        quotas = models.ChallengeQuota.__table__
+        try:
+            async with models.AsyncSessionLocal() as db:
+                if deltas:
+                    await db.execute(
+                        update(quotas).where(quotas.c.user_id == bindparam("uid")).values(quota_remaining=quotas.c.quota_remaining - bindparam("delta")),
+                        deltas,
+                    )
+                if resets:
+                    await db.execute(
+                        update(quotas).where(quotas.c.user_id == bindparam("uid")).values(quota_remaining=bindparam("remaining"), last_reset_date=bindparam("reset_date")),
+                        resets,
+                    )
+                await db.commit()
+        except Exception:
+            # Put the changes back so the next flush retries them
+            for counter, pending, reset_pending in taken:
+                counter.pending += pending
+                counter.reset_pending = counter.reset_pending or reset_pending
+                self._dirty.add(counter.user_id)
+            raise
+
+        self.flushes += 1
+        self._evict_idle()
+        return len(taken)
+
+    def _evict_idle(self):
+        idle_before = time.monotonic() - QUOTA_IDLE_SECONDS
+        total = sum(len(shard) for shard in self._shards)
+        for shard in self._shards:
+            for user_id, counter in list(shard.items()):
+                if user_id in self._dirty:
+                    continue
+                if counter.last_used < idle_before or total > QUOTA_MAX_USERS:
+                    del shard[user_id]
+                    total -= 1
+
+    async def _flush_forever(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), timeout=QUOTA_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Quota flush failed: {str(e)}")
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_forever())
+
+    async def stop(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "backend": "write_behind",
+            "users": sum(len(shard) for shard in self._shards),
+            "dirty": len(self._dirty),
+            "loads": self.loads,
+            "flushes": self.flushes,
+        }
+
+
+class StrictQuotaStore:
+    """Straight through to the atomic db statements"""
+
+    async def consume(self, db: AsyncSession, user_id: int, amount: int = 1, min_remaining: Optional[int] = quota_db.COVER_AMOUNT):
+        return await quota_db.consume_quota(db, user_id, amount, min_remaining)
+
+    async def refund(self, db: AsyncSession, user_id: int, amount: int):
+        return await quota_db.refund_quota(db, user_id, amount)
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": "strict"}
+
+
+def build_quota_store(backend: str = QUOTA_BACKEND):
+    if backend == "write_behind":
+        return WriteBehindQuotaStore()
+    if backend == "strict":
+        return StrictQuotaStore()
+    raise RuntimeError(f"Unknown QUOTA_BACKEND: {backend}")
+
+
+quota_store = build_quota_store()
+
+
+async def consume_quota(db: AsyncSession, user_id: int, amount: int = 1, min_remaining: Optional[int] = quota_db.COVER_AMOUNT):
+    """Same contract as database.db.consume_quota, served by the configured backend"""
+    with tracer.span("quota.consume", backend=QUOTA_BACKEND, amount=amount):
+        return await quota_store.consume(db, user_id, amount, min_remaining)
+
+
+async def refund_quota(db: AsyncSession, user_id: int, amount: int):
+    with tracer.span("quota.refund", backend=QUOTA_BACKEND, amount=amount):
+        return await quota_store.refund(db, user_id, amount)
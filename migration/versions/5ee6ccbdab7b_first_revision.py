@@ -20,13 +20,59 @@ depends_on: Union[str, Sequence[str], None] = None
 
 def upgrade() -> None:
     """Upgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    pass
-    # ### end Alembic commands ###
+    # Tables as the app's create_all used to build them, databases it already created are left alone
+    inspector = sa.inspect(op.get_bind())
+
+    if not inspector.has_table("users"):
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("username", sa.String(), nullable=True),
+            sa.Column("email", sa.String(), nullable=True),
+            sa.Column("hashed_password", sa.String(), nullable=True),
+            sa.Column("disabled", sa.Boolean(), nullable=True),
+            sa.Column("provider", sa.String(), nullable=True),
+            sa.Column("image", sa.String(), nullable=True),
+            sa.Column("role", sa.String(), nullable=False),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_username", "users", ["username"], unique=True)
+        op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    if not inspector.has_table("challenges"):
+        op.create_table(
+            "challenges",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("difficulty", sa.String(), nullable=False),
+            sa.Column("programming_language", sa.String(), nullable=False),
+            sa.Column("date_created", sa.DateTime(), nullable=True),
+            sa.Column("title", sa.String(), nullable=False),
+            sa.Column("options", sa.String(), nullable=False),
+            sa.Column("correct_answer_id", sa.Integer(), nullable=False),
+            sa.Column("user_answer", sa.Integer(), nullable=True),
+            sa.Column("explanation", sa.String(), nullable=False),
+            sa.Column("question_id", sa.String(), nullable=True),
+            sa.Column("user_id", sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_challenges_question_id", "challenges", ["question_id"], unique=True)
+
+    if not inspector.has_table("challenge_quotas"):
+        op.create_table(
+            "challenge_quotas",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("quota_remaining", sa.Integer(), nullable=False),
+            sa.Column("last_reset_date", sa.DateTime(), nullable=True),
+            sa.Column("user_id", sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+            sa.PrimaryKeyConstraint("id"),
+        )
 
 
 def downgrade() -> None:
     """Downgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    pass
-    # ### end Alembic commands ###
+    op.drop_table("challenge_quotas")
+    op.drop_table("challenges")
+    op.drop_table("users")
@@ -0,0 +1,40 @@
+"""Unique quota row per user
+
+Revision ID: 7c1d2e9a4b10
+Revises: 5ee6ccbdab7b
+Create Date: 2026-10-18 14:30:12.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c1d2e9a4b10'
+down_revision: Union[str, Sequence[str], None] = '5ee6ccbdab7b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Databases built by the app's create_all (DB_CREATE_ALL) already have the constraint
+    existing = sa.inspect(op.get_bind()).get_unique_constraints("challenge_quotas")
+    if any(constraint["name"] == "uq_challenge_quotas_user_id" for constraint in existing):
+        return
+
+    # Racing quota creation could leave several rows for a user, keep the latest one
+    op.execute(
+        "DELETE FROM challenge_quotas WHERE id NOT IN "
+        "(SELECT MAX(id) FROM challenge_quotas GROUP BY user_id)"
+    )
+    with op.batch_alter_table("challenge_quotas") as batch_op:
+        batch_op.create_unique_constraint("uq_challenge_quotas_user_id", ["user_id"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("challenge_quotas") as batch_op:
+        batch_op.drop_constraint("uq_challenge_quotas_user_id", type_="unique")
@@ -0,0 +1,34 @@
+"""Composite index for per user challenge lookups
+
+Revision ID: b3f8a61c2d47
+Revises: 7c1d2e9a4b10
+Create Date: 2026-10-18 14:52:40.503117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3f8a61c2d47'
+down_revision: Union[str, Sequence[str], None] = '7c1d2e9a4b10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # create_all may already have built it on a fresh database
+    op.create_index(
+        "ix_challenges_user_language_difficulty_created",
+        "challenges",
+        ["user_id", "programming_language", "difficulty", "date_created"],
+        if_not_exists=True,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_challenges_user_language_difficulty_created", table_name="challenges", if_exists=True)
@@ -0,0 +1,223 @@
+from dotenv import load_dotenv
+from typing import Optional
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import HTMLRenderer, SpeedscopeRenderer
+except ImportError:
+    Profiler = None
+
+
+load_dotenv()
+
+# Profile every request (still rate limited), otherwise only requests with a valid signed X-Profile header
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+# HMAC key for X-Profile, header-triggered profiling is off while it's empty
+PROFILING_SECRET = os.getenv("PROFILING_SECRET", "")
+PROFILING_SIGNATURE_TTL = float(os.getenv("PROFILING_SIGNATURE_TTL", "300"))
+# Only requests slower than this are written out
+PROFILING_THRESHOLD_MS = float(os.getenv("PROFILING_THRESHOLD_MS", "500"))
+PROFILING_INTERVAL = float(os.getenv("PROFILING_INTERVAL", "0.001"))
+PROFILING_MAX_PER_MINUTE = float(os.getenv("PROFILING_MAX_PER_MINUTE", "6"))
+PROFILING_DIR = os.getenv("PROFILING_DIR", "profiles")
+# speedscope or html, html needs pyinstrument
+PROFILING_FORMAT = os.getenv("PROFILING_FORMAT", "speedscope")
+PROFILE_HEADER = b"x-profile"
+MAX_STACK_DEPTH = 128
+
+
+def sign_profile_request(path: str, timestamp: Optional[int] = None, secret: str = PROFILING_SECRET) -> str:
+    """Value for the X-Profile header, valid for one path during PROFILING_SIGNATURE_TTL"""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    digest = hmac.new(secret.encode(), f"{timestamp}:{path}".encode(), hashlib.sha256).hexdigest()
+    return f"{timestamp}:{digest}"
+
+
+def verify_profile_header(value: str, path: str, secret: str = PROFILING_SECRET) -> bool:
+    if not secret or ":" not in value:
+        return False
+    timestamp, _ = value.split(":", 1)
+    if not timestamp.isdigit() or abs(time.time() - int(timestamp)) > PROFILING_SIGNATURE_TTL:
+        return False
+    return hmac.compare_digest(value, sign_profile_request(path, int(timestamp), secret))
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float = PROFILING_MAX_PER_MINUTE):
+        self.rate = per_minute / 60
+        self.capacity = max(per_minute, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class StackSampler:
+    """
+    Fallback when pyinstrument isn't installed, samples the event loop thread from a
+    background thread. It sees everything the loop runs, so concurrent requests show up too.
+    """
+
+    def __init__(self, interval: float = PROFILING_INTERVAL):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.frames = {}
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+        self.started = 0.0
+        self.duration = 0.0
+
+    def _frame_index(self, frame) -> int:
+        code = frame.f_code
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        index = self.frames.get(key)
+        if index is None:
+            index = self.frames[key] = len(self.frames)
+        return index
+
+    def _sample_forever(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(self._frame_index(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples.append(stack[::-1])
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample_forever, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started
+
+    def speedscope(self, name: str) -> str:
+        frames = [{"name": function, "file": file, "line": line} for (function, file, line) in self.frames]
+        return json.dumps({
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": self.duration,
+                "samples": self.samples,
+                "weights": [self.interval] * len(self.samples),
+            }],
+            "exporter": "stack-sampler",
+        })
+
+
+class RequestProfile:
+    """One request's profile, pyinstrument when available, the stack sampler otherwise"""
+
+    def __init__(self, interval: float = PROFILING_INTERVAL, output_format: str = PROFILING_FORMAT):
+        self.output_format = output_format if Profiler is not None else "speedscope"
+        self.profiler = Profiler(interval=interval, async_mode="enabled") if Profiler is not None else StackSampler(interval)
+
+    def start(self):
+        self.profiler.start()
+
+    def stop(self):
+        self.profiler.stop()
+
+    @property
+    def extension(self) -> str:
+        return ".html" if self.output_format == "html" else ".speedscope.json"
+
+    def render(self, name: str) -> str:
+        if isinstance(self.profiler, StackSampler):
+            return self.profiler.speedscope(name)
+        renderer = HTMLRenderer() if self.output_format == "html" else SpeedscopeRenderer()
+        return self.profiler.output(renderer)
+
+
+def write_profile(directory: str, filename: str, content: str) -> str:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, filename)
+    with open(path, "w") as f:
+        f.write(content)
+    return path
+
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI, profiles opted-in requests and keeps the slow ones.
+    At most one request is profiled at a time and starts are rate limited, anything
+    else goes straight through.
+    """
+
+    def __init__(self, app, enabled: bool = PROFILING_ENABLED, secret: str = PROFILING_SECRET, threshold_ms: float = PROFILING_THRESHOLD_MS, directory: str = PROFILING_DIR):
+        self.app = app
+        self.enabled = enabled
+        self.secret = secret
+        self.threshold_ms = threshold_ms
+        self.directory = directory
+        self.bucket = TokenBucket()
+        self._active = False
+
+    def wants_profile(self, scope) -> bool:
+        if self.enabled:
+            return True
+        if not self.secret:
+            return False
+        value = dict(scope.get("headers") or []).get(PROFILE_HEADER)
+        return value is not None and verify_profile_header(value.decode("latin-1"), scope.get("path", ""), self.secret)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self._active or not self.wants_profile(scope) or not self.bucket.take():
+            return await self.app(scope, receive, send)
+
+        self._active = True
+        profile = RequestProfile()
+        started = time.perf_counter()
+        profile.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profile.stop()
+            self._active = False
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if elapsed_ms >= self.threshold_ms:
+                await self.save(profile, scope, elapsed_ms)
+
+    async def save(self, profile: RequestProfile, scope, elapsed_ms: float):
+        method = scope.get("method", "")
+        path = scope.get("path", "")
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", path).strip("-") or "root"
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{method.lower()}-{slug[:60]}-{elapsed_ms:.0f}ms{profile.extension}"
+        try:
+            content = await asyncio.to_thread(profile.render, f"{method} {path} {elapsed_ms:.0f}ms")
+            saved = await asyncio.to_thread(write_profile, self.directory, filename, content)
+            print(f"Profile written: {saved}")
+        except Exception as e:
+            print(f"Profile not written: {str(e)}")
+
+
+if __name__ == "__main__":
+    # python -m package.profiling /api/generate-challenge -> X-Profile header value
+    if not PROFILING_SECRET:
+        sys.exit("PROFILING_SECRET is not set")
+    print(sign_profile_request(sys.argv[1] if len(sys.argv) > 1 else "/"))
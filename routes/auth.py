@@ -1,16 +1,19 @@
 from fastapi import APIRouter, status, HTTPException, Depends, Request
 from fastapi.responses import RedirectResponse, JSONResponse
-from passlib.context import CryptContext
 from jose import jwt, JWTError
 from pydantic import BaseModel
 from ..database.models import User, db_dependency
 from datetime import timedelta, datetime, timezone
 from typing import Annotated, Optional
-from sqlalchemy.orm import Session
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from enum import Enum
 import os
+import time
 from dotenv import load_dotenv
-from ..social_credeentials.google_oauth import oauth
+from ..social_credeentials.google_oauth import get_oauth
+from .passwords import hash_password, verify_password
+from .user_cache import user_cache
 
     
 load_dotenv()   
@@ -23,6 +26,12 @@ router = APIRouter(
 SECRET_KEY=os.getenv("AUTH_SECRET_KEY")
 ALGORITHM=os.getenv("AUTH_ALGORITHM")
 EXPIRATION=100
+# Put role/image/disabled into the token and skip the db lookup for tokens that carry them
+TRUST_TOKEN_CLAIMS = os.getenv("AUTH_TRUST_TOKEN_CLAIMS", "false").lower() == "true"
+# How long after issue the claims are trusted, older tokens go through the user cache/db.
+# Disables/role changes only invalidate the worker that made them, so on the other workers
+# a disabled or demoted user keeps their claims for up to this long, lower it to tighten that
+TOKEN_CLAIMS_MAX_AGE_SECONDS = float(os.getenv("AUTH_TOKEN_CLAIMS_MAX_AGE_SECONDS", "900"))
 
 class UserRole(str, Enum):
     ADMIN = "admin"
@@ -58,36 +67,70 @@ class GetUser(BaseModel):
     role: UserRole
     image: Optional[str] = None
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 # OAuth2PasswordBearer will not retrieve the token from a cookie — it only looks for the token in the Authorization header by default.
 # oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 is_prod = os.getenv("ENV") == "production"
 
-def get_user_from_db(db: Session, email: str):
-    return db.query(User).filter( User.email == email).first()
+async def get_user_from_db(db: AsyncSession, email: str):
+    result = await db.execute(select(User).where(User.email == email).limit(1))
+    return result.scalars().first()
 
 
-def authenticate_user(email, password, db: db_dependency):
+async def authenticate_user(email, password, db: db_dependency):
 
-    user_exists = get_user_from_db(db, email=email)
+    user_exists = await get_user_from_db(db, email=email)
     
   
     if not user_exists:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unregistered email, please create an account!")
     
-    if not pwd_context.verify(password, user_exists.hashed_password):
+    is_valid, new_hash = await verify_password(password, user_exists.hashed_password)
+    if not is_valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials, probably inputed a wrong password or email")
+
+    # Stored with an outdated bcrypt cost, upgrade it now that we have the plain password
+    if new_hash:
+        user_exists.hashed_password = new_hash
+        await db.commit()
     
     return user_exists
 
-def create_access_token(email: str, user_id: int, expires_delta: timedelta):
+def create_access_token(email: str, user_id: int, expires_delta: timedelta, user=None):
     encode = {"sub": email, "id": user_id}
-    expires = datetime.now(timezone.utc) + expires_delta
-    encode.update({"exp": expires})
+    now = datetime.now(timezone.utc)
+    expires = now + expires_delta
+    encode.update({"exp": expires, "iat": now})
+
+    if TRUST_TOKEN_CLAIMS and user is not None:
+        encode.update({"role": user.role, "disabled": bool(user.disabled), "username": user.username, "image": user.image})
 
     return jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_current_active_user(db: db_dependency, request: Request) -> GetUser:
+
+def invalidate_user(user_id: int):
+    """Call after disabling a user or changing their role, ORM updates to User do it automatically"""
+    user_cache.invalidate(user_id)
+
+
+@event.listens_for(User, "after_update")
+def _invalidate_updated_user(mapper, connection, target):
+    invalidate_user(target.id)
+
+
+@event.listens_for(User, "after_delete")
+def _invalidate_deleted_user(mapper, connection, target):
+    invalidate_user(target.id)
+
+
+def user_from_claims(payload: dict) -> Optional[GetUser]:
+    if not TRUST_TOKEN_CLAIMS or "role" not in payload or "id" not in payload:
+        return None
+    issued_at = payload.get("iat", 0)
+    if time.time() - issued_at > TOKEN_CLAIMS_MAX_AGE_SECONDS or user_cache.invalidated_since(payload["id"], issued_at):
+        return None
+    return GetUser(id=payload["id"], email=payload["sub"], username=payload.get("username"), disabled=payload.get("disabled", False), role=payload["role"], image=payload.get("image"))
+
+async def get_current_active_user(db: db_dependency, request: Request) -> GetUser:
     error = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Access denied", headers={"www-Authenticate": "Bearer"})
 
     token = request.cookies.get("access_token")
@@ -99,12 +142,20 @@ def get_current_active_user(db: db_dependency, request: Request) -> GetUser:
         token_data = TokenData(email=email)
     except JWTError:
         raise error
-    
-    user = get_user_from_db(db, token_data.email)
-    if user is None or user.disabled :
+
+    user_id = payload.get("id")
+    active_user = user_from_claims(payload) or (user_cache.get(user_id) if user_id is not None else None)
+
+    if active_user is None:
+        user = await get_user_from_db(db, token_data.email)
+        if user is None:
+            raise error
+        active_user = GetUser(id=user.id, email=user.email, disabled=user.disabled, role=user.role, image=user.image)
+        user_cache.set(user.id, active_user)
+
+    # A token for another account, e.g. a recreated email, must not resolve to the cached user
+    if active_user.disabled or active_user.email != token_data.email:
         raise error
-    
-    active_user = GetUser(id=user.id, email=user.email, disabled=user.disabled, role=user.role, image=user.image)
 
     return active_user
 
@@ -117,19 +168,19 @@ async def create_user(db: db_dependency,  create_user_request: CreateUser):
 
     try:
         email = create_user_request.email.lower()
-        user_exists = db.query(User).filter(User.email == email).first()
+        user_exists = await get_user_from_db(db, email)
         if user_exists:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered, please login!")
 
-        hashed_password = pwd_context.hash(create_user_request.password)
+        hashed_password = await hash_password(create_user_request.password)
         new_user = User(email=email, hashed_password=hashed_password, role=UserRole.USER)
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
+        await db.refresh(new_user)
 
         new_user = GetUser(id=new_user.id, email=new_user.email, disabled=new_user.disabled, role=new_user.role)
 
-        token = create_access_token(new_user.email, new_user.id, timedelta(minutes=EXPIRATION)) 
+        token = create_access_token(new_user.email, new_user.id, timedelta(minutes=EXPIRATION), user=new_user)
 
     
         response = JSONResponse(status_code=status.HTTP_201_CREATED, content={**new_user.model_dump()})
@@ -144,6 +195,9 @@ async def create_user(db: db_dependency,  create_user_request: CreateUser):
         )
         return response
     except HTTPException as e:
+        # Password workers saturated, let the client retry
+        if e.status_code == status.HTTP_503_SERVICE_UNAVAILABLE:
+            raise
         # Re-raise custom HTTP exceptions
         return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"error": True, "message": e.detail})
 
@@ -166,12 +220,12 @@ async def login(login_data: LoginUser, db: db_dependency ):
 
     try:      
 
-        user = authenticate_user(email=login_data.email.lower(), password=login_data.password, db=db)
+        user = await authenticate_user(email=login_data.email.lower(), password=login_data.password, db=db)
 
         if not user:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate user")
 
-        token = create_access_token(user.email, user.id, timedelta(minutes=EXPIRATION))  
+        token = create_access_token(user.email, user.id, timedelta(minutes=EXPIRATION), user=user)
     
         response = JSONResponse(status_code=status.HTTP_200_OK, content={       "username":user.username,
                 "email": user.email,
@@ -190,6 +244,8 @@ async def login(login_data: LoginUser, db: db_dependency ):
         return response
     
     except HTTPException as e:
+        if e.status_code == status.HTTP_503_SERVICE_UNAVAILABLE:
+            raise
         return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"Error": True, "message": e.detail})
 
 @router.get("/user")
@@ -201,12 +257,12 @@ async def get_users(current_user: active_user_dependnecy):
 @router.get("/google/login")
 async def login_with_google(request: Request):
     redirect_uri = request.url_for("google_callback")
-    return await oauth.google.authorize_redirect(request, redirect_uri)
+    return await get_oauth().google.authorize_redirect(request, redirect_uri)
 
 @router.get("/google/callback", name="google_callback")
 async def google_callback(request: Request, db: db_dependency):
 
-    token = await oauth.google.authorize_access_token(request)
+    token = await get_oauth().google.authorize_access_token(request)
 
   
     id_token = token.get("id_token")
@@ -224,15 +280,15 @@ async def google_callback(request: Request, db: db_dependency):
     if not email:
         raise HTTPException(status_code=400, detail="Failed to fetch user email")
     
-    user = get_user_from_db(db, email=email)
+    user = await get_user_from_db(db, email=email)
 
     if not user:
         user = User(email=email, provider=Provider.google, role=UserRole.USER, image=image)
         db.add(user)
-        db.commit()
-        db.refresh(user)    
+        await db.commit()
+        await db.refresh(user)    
 
-    token = create_access_token(user.email, user.id, timedelta(minutes=EXPIRATION))
+    token = create_access_token(user.email, user.id, timedelta(minutes=EXPIRATION), user=user)
 
     response = RedirectResponse(url="/agentQ", status_code=302)
     response.set_cookie(
@@ -1,19 +1,30 @@
-from fastapi import APIRouter, HTTPException, Request, status
-from ..agents.ai_generator import generate_questions
-from ..database.db import (
-    get_challenge_quota,
-    create_challenge_quota,
-    reset_quota_if_needed,
-    get_user_challenges
-)
+from fastapi import APIRouter, HTTPException, Query, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from ..agents.ai_generator import generate_questions, load_existing_titles, questions_to_generate, stream_question_graph
+from ..agents.dedup_index import get_question_index, remember_titles
+from ..agents.question_pool import question_pool
+from ..database.db import aget_user_challenges_page, aupsert_challenges
+from ..database.quota_store import consume_quota, refund_quota
 from .auth import  active_user_dependnecy
-from ..database.models import User, db_dependency
-from ..database.models import Challenge
+from ..database.models import AsyncSessionLocal, db_dependency
 from .route_schemas import ChallengeRequest, QuestionsToFrontEndOutput, QuestionToFrontEndModel, SaveQuestionsToHistory
+from collections import defaultdict
 from datetime import datetime
+from dotenv import load_dotenv
+from typing import Literal, Optional
+import anyio
+import base64
 import json
+import os
 
 
+load_dotenv()
+
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "100"))
+
 router = APIRouter()
 
 
@@ -22,57 +33,198 @@ async def generate_challenge(questSettings: ChallengeRequest, active_user: activ
     
     if questSettings.difficulty is None:
         return
-    try:
-        user_id = active_user.id
-        quota = get_challenge_quota(db, user_id)
-        if not quota: 
-            quota = create_challenge_quota(db, user_id)
 
-        quota = reset_quota_if_needed(db, quota)
-
-        if quota.quota_remaining <= 0:
-            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Insufficient Quota")
-        
-         
+    user_id = active_user.id
+    # Reserves the whole set up front, whatever isn't delivered is given back below
+    requested = questions_to_generate(questSettings.difficulty)
+    if await consume_quota(db, user_id, requested) is None:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Insufficient Quota")
 
-        
-        challenge_data = generate_questions(questSettings, db, user_id)
+    delivered = 0
+    try:
+        existing_titles = await load_existing_titles(db, user_id, questSettings.programmingLanguage, questSettings.difficulty)
+        # Ends the read transaction so the pooled connection isn't held through the generation
+        await db.commit()
+
+        # Serve from the pre-generated pool, live generation only when it can't cover the request
+        challenge_data = None
+        if question_pool.enabled:
+            seen_index = get_question_index(user_id, questSettings.programmingLanguage, questSettings.difficulty)
+            await run_in_threadpool(seen_index.sync, existing_titles)
+            challenge_data = question_pool.take(questSettings.programmingLanguage, questSettings.difficulty, questions_to_generate(questSettings.difficulty), seen_index.is_duplicate)
+
+        if challenge_data is None:
+            challenge_data = await generate_questions(questSettings, db, user_id, existing_titles)
        
         generated_questions = []
         for q_data in challenge_data:
             parsed_question = QuestionToFrontEndModel(**q_data)  # Validates & converts
             generated_questions.append(parsed_question)
-            quota.quota_remaining -= 1
 
-        db.commit()
+        delivered = len(generated_questions)
         return QuestionsToFrontEndOutput(questions=generated_questions)
 
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
+    finally:
+        if delivered < requested:
+            await _refund_quota(user_id, requested - delivered)
+
+
+async def _refund_quota(user_id: int, amount: int):
+    # The request session may be closed or mid-transaction by now, refunds use their own
+    async with AsyncSessionLocal() as db:
+        return await refund_quota(db, user_id, amount)
+
+
+async def pooled_events(challenge_data: list):
+    for q_data in challenge_data:
+        yield {"type": "question", "question": q_data}
+
+
+async def stream_challenge_response(questSettings: ChallengeRequest, user_id: int, existing_titles: list, requested: int, quota_remaining: int):
+    """
+    SSE framing of the generation, one event per accepted question then a summary.
+    quota_remaining is what's left after reserving requested.
+    """
+    delivered = 0
+    refunded = False
+    try:
+        try:
+            challenge_data = None
+            if question_pool.enabled:
+                seen_index = get_question_index(user_id, questSettings.programmingLanguage, questSettings.difficulty)
+                await run_in_threadpool(seen_index.sync, existing_titles)
+                challenge_data = question_pool.take(questSettings.programmingLanguage, questSettings.difficulty, questions_to_generate(questSettings.difficulty), seen_index.is_duplicate)
+
+            if challenge_data is not None:
+                events = pooled_events(challenge_data)
+            else:
+                events = stream_question_graph(questSettings.programmingLanguage, questSettings.difficulty, existing_titles, user_id)
+
+            async for event in events:
+                if event["type"] == "question":
+                    question = QuestionToFrontEndModel(**event["question"])
+                    delivered += 1
+                    yield f'data: {json.dumps({"type": "question", "question": question.model_dump()})}\n\n'
+                else:
+                    yield f'data: {json.dumps(event)}\n\n'
+
+        except Exception as e:
+            yield f'data: {json.dumps({"type": "error", "message": str(e)})}\n\n'
+
+        if delivered < requested:
+            quota_remaining = await _refund_quota(user_id, requested - delivered)
+        refunded = True
+        yield f'data: {json.dumps({"type": "summary", "questions": delivered, "quota_charged": delivered, "quota_remaining": quota_remaining})}\n\n'
+        yield f'data: {{"type": "end"}}\n\n'
+    finally:
+        # Client went away mid-stream, only what was delivered stays charged
+        if not refunded and delivered < requested:
+            with anyio.CancelScope(shield=True):
+                await _refund_quota(user_id, requested - delivered)
+
+
+@router.post("/generate-challenge/stream")
+async def generate_challenge_stream(questSettings: ChallengeRequest, active_user: active_user_dependnecy, db: db_dependency):
+
+    user_id = active_user.id
+    requested = questions_to_generate(questSettings.difficulty)
+    quota = await consume_quota(db, user_id, requested)
+    if quota is None:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Insufficient Quota")
+
+    try:
+        existing_titles = await load_existing_titles(db, user_id, questSettings.programmingLanguage, questSettings.difficulty)
+    except Exception:
+        await _refund_quota(user_id, requested)
+        raise
+
+    return StreamingResponse(stream_challenge_response(questSettings, user_id, existing_titles, requested, quota["quota_remaining"]), media_type="text/event-stream")
+
+
+def encode_history_cursor(challenge: dict) -> str:
+    raw = json.dumps([challenge["date_created"].isoformat(), challenge["id"]])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_history_cursor(cursor: str) -> tuple:
+    try:
+        date_created, challenge_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(date_created), int(challenge_id)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+async def stream_history(user_id: int, after: Optional[tuple], filters: dict):
+    """NDJSON, one challenge per line, read a page at a time so the history is never held whole"""
+    # The request session is closed once streaming starts, so this uses its own
+    async with AsyncSessionLocal() as db:
+        while True:
+            page = await aget_user_challenges_page(db, user_id, HISTORY_MAX_PAGE_SIZE, after, **filters)
+            for challenge in page:
+                yield json.dumps(jsonable_encoder(challenge)) + "\n"
+            if len(page) < HISTORY_MAX_PAGE_SIZE:
+                break
+            after = (page[-1]["date_created"], page[-1]["id"])
 
 
 @router.get("/my_history")
-async def my_history(questSettings: Request, db: db_dependency):
-    
-    user_id = questSettings.get("user_id")
+async def my_history(
+    active_user: active_user_dependnecy,
+    db: db_dependency,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    programmingLanguage: Optional[str] = None,
+    difficulty: Optional[str] = None,
+    correct: Optional[bool] = None,
+    format: Literal["json", "ndjson"] = "json",
+):
+    """
+    Newest first, paged by keyset on (date_created, id).
+    Pass next_cursor back as cursor for the following page, ndjson streams everything after the cursor.
+    """
+    user_id = active_user.id
+    limit = min(limit or HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE)
+    after = decode_history_cursor(cursor) if cursor else None
+    filters = {"programming_language": programmingLanguage, "difficulty": difficulty, "correct": correct}
+
+    if format == "ndjson":
+        return StreamingResponse(stream_history(user_id, after, filters), media_type="application/x-ndjson")
 
-    challenges = get_user_challenges(db, user_id)
-    return {"challenges": challenges}
+    # One extra row tells whether there is a next page
+    challenges = await aget_user_challenges_page(db, user_id, limit + 1, after, **filters)
+    next_cursor = encode_history_cursor(challenges[limit - 1]) if len(challenges) > limit else None
+
+    return {"challenges": challenges[:limit], "next_cursor": next_cursor}
 
 @router.post("/save_to_history")
 async def save_challenges_to_history(db: db_dependency, data_to_be_saved: list[SaveQuestionsToHistory], active_user: active_user_dependnecy):
 
   
     user_id = active_user.id
-    user = db.query(User).filter_by(id = user_id).first()
-    challenges_to_save = []
-    for challenge in data_to_be_saved:
-        new_challenge =Challenge(difficulty=challenge.difficulty, programming_language=challenge.programmingLanguage, user=user, title=challenge.title, options=json.dumps(challenge.options), correct_answer_id=challenge.correct_answer_id, user_answer=challenge.userAnswer, explanation=challenge.explanation, question_id=challenge.question_id)
+    challenges_to_save = [
+        {
+            "difficulty": challenge.difficulty,
+            "programming_language": challenge.programmingLanguage,
+            "title": challenge.title,
+            "options": json.dumps(challenge.options),
+            "correct_answer_id": challenge.correct_answer_id,
+            "user_answer": challenge.userAnswer,
+            "explanation": challenge.explanation,
+            "question_id": challenge.question_id,
+        }
+        for challenge in data_to_be_saved
+    ]
 
-        challenges_to_save.append(new_challenge)
+    # Idempotent, re-submitting a session updates the saved answers
+    await aupsert_challenges(db, user_id, challenges_to_save)
 
-    db.add_all(challenges_to_save)
-    db.commit()
+    titles = defaultdict(list)
+    for challenge in data_to_be_saved:
+        titles[(challenge.programmingLanguage, challenge.difficulty)].append(challenge.title)
+    for (programming_language, difficulty), saved_titles in titles.items():
+        remember_titles(user_id, programming_language, difficulty, saved_titles)
         
 
     return {"success": True, "message":"Question section successfully saved!"}
@@ -83,13 +235,5 @@ async def save_challenges_to_history(db: db_dependency, data_to_be_saved: list[S
 async def get_quota( user_details: active_user_dependnecy,  db: db_dependency):
     
     user_id = user_details.id
-    quota = get_challenge_quota(db, user_id)
-    if not quota:
-        return {
-            "user_id": user_id,
-            "quota_remaining": 50,
-            "last_reset_date": datetime.now()
-        }
-
-    quota = reset_quota_if_needed(db, quota)
-    return quota
+    # Nothing charged, this only creates/resets the row and reads it back
+    return await consume_quota(db, user_id, amount=0, min_remaining=None)
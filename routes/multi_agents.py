@@ -1,14 +1,14 @@
 import json
 from fastapi import APIRouter, Depends, HTTPException, Request, Query, Header
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from ..database.db import (create_challenge_quota, get_challenge_quota, reset_quota_if_needed, )
-from ..database.models import get_db
+from ..database.quota_store import consume_quota
 from typing import Optional
 from langchain_core.messages import HumanMessage, AIMessageChunk
 from uuid import uuid4
-from ..agents.researcher import graph
+from ..agents.researcher import SUMMARY_TAG, get_graph
+from ..agents.checkpointer import researcher_checkpointer
 from ..utils import authenticate_and_get_user_details
+from ..tracing import tracer
 from .auth import db_dependency, active_user_dependnecy
 
 
@@ -25,6 +25,9 @@ def serialise_ai_message_chunk(chunk):
 async def generate_chat_response(message: str, checkpoint_id: Optional[str] = None):
     """Func for generate ai response"""
     is_new_conversation = checkpoint_id is None
+    # Set when this request is traced, lets a slow answer be matched to its spans
+    trace_id = tracer.current_trace_id()
+    trace_field = f',"trace_id":"{trace_id}"' if trace_id else ""
 
     if is_new_conversation:
         # Checkpoint_id generation
@@ -35,22 +38,22 @@ async def generate_chat_response(message: str, checkpoint_id: Optional[str] = No
         }
 
         # first message initialization
-        events = graph.astream_events({"messages": [HumanMessage(content=message)]}, version="v2", config=config)
+        events = get_graph().astream_events({"messages": [HumanMessage(content=message)]}, version="v2", config=config)
 
         #Sending checkpoint ID
-        yield  f'data: {{"type":"checkpoint","checkpoint_id":"{new_checkpoint_id}"}}\n\n'
+        yield  f'data: {{"type":"checkpoint","checkpoint_id":"{new_checkpoint_id}"{trace_field}}}\n\n'
             
     else:
         config = {"configurable": {"thread_id": checkpoint_id}}
         # Existing message continuation
-        events = graph.astream_events({"messages": [HumanMessage(content=message)]}, version="v2", config=config)
+        events = get_graph().astream_events({"messages": [HumanMessage(content=message)]}, version="v2", config=config)
     
     async for event in events:
         event_type = event["event"]
 # payload = {"type": "content", "content": chunk_content}
 # yield f"data: {json.dumps(payload)}\n\n"
         # For content stream
-        if event_type == "on_chat_model_stream":
+        if event_type == "on_chat_model_stream" and SUMMARY_TAG not in event.get("tags", []):
             chunk_content = serialise_ai_message_chunk(event["data"]["chunk"])
             # Escaping single quotes and newlines for JSON parsing
             # safe_content = chunk_content.replace('"', '\\"').replace("\n","\\n" )
@@ -70,8 +73,8 @@ async def generate_chat_response(message: str, checkpoint_id: Optional[str] = No
                 yield f'data: {{"type":"search_start","query":"{safe_query}"}}\n\n'
         
         # For retrieving research urls
-        elif event_type == "on_tool_end" and event["name"] == "tavily_search_results_json":
-            # Search completed - send results or error
+        elif event_type == "on_custom_event" and event["name"] == "search_results":
+            # Search completed (or served from the search cache) - send results or error
             # -------------********------------
             # output = event["data"]["output"]
             output = event["data"]["output"]
@@ -88,7 +91,7 @@ async def generate_chat_response(message: str, checkpoint_id: Optional[str] = No
                 urls_to_json = json.dumps(urls)
                 yield f'data: {{"type": "search_results", "urls": {urls_to_json}}}\n\n'
 
-    yield f'data: {{"type": "end"}}\n\n'
+    yield f'data: {{"type": "end"{trace_field}}}\n\n'
 
 
 
@@ -98,19 +101,8 @@ async def researcher(message:str, request_obj: Request, db: db_dependency, user_
 
     try:
         user_id = user_details.id
-        quota = get_challenge_quota(db, user_id)
-        # print("🐳🐳🐳🐳1:", quota.user_id)
-
-        if not quota:
-            quota = create_challenge_quota(db, user_details)
-        quota = reset_quota_if_needed(db, quota)
-        # print("🐳🐳🐳🐳2:", quota.quota_remaining)
-
-        if quota.quota_remaining <= 0:
+        if await consume_quota(db, user_id) is None:
             raise HTTPException(status_code=429, detail="Insufficient Quota")
-        
-        quota.quota_remaining -= 1
-        db.commit()
 
         return StreamingResponse(generate_chat_response(message, checkpoint_id), media_type="text/event-stream")
     except Exception as e:
@@ -118,6 +110,12 @@ async def researcher(message:str, request_obj: Request, db: db_dependency, user_
     
 
 
+
+@router.get("/checkpointer/stats")
+async def checkpointer_stats(user_details: active_user_dependnecy):
+    """Memory held by the researcher conversation threads"""
+    return researcher_checkpointer.stats()
+
     
 # https://bagent.onrender.com/agent/researcher?message=hello
 
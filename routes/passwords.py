@@ -0,0 +1,61 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+
+load_dotenv()
+
+# Changing the cost rehashes each password on its next successful login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", "2"))
+# Hashes allowed to wait for a worker before new ones are turned away
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", "32"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+class PasswordPool:
+    """
+    Runs bcrypt off the event loop on a few dedicated threads (bcrypt releases the GIL).
+    Once workers + queue_limit calls are pending, new ones fail fast with a 503
+    instead of piling up behind a login burst.
+    """
+
+    def __init__(self, workers: int = PASSWORD_WORKERS, queue_limit: int = PASSWORD_QUEUE_LIMIT):
+        self.capacity = workers + queue_limit
+        self.pending = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+
+    async def run(self, fn, *args):
+        if self.pending >= self.capacity:
+            self.rejected += 1
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server busy, please try again shortly", headers={"Retry-After": "1"})
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        return {"pending": self.pending, "capacity": self.capacity, "rejected": self.rejected}
+
+
+password_pool = PasswordPool()
+
+
+async def hash_password(password: str) -> str:
+    return await password_pool.run(pwd_context.hash, password)
+
+
+async def verify_password(password: str, hashed_password: Optional[str]) -> Tuple[bool, Optional[str]]:
+    """(is_valid, new_hash), new_hash is set when the stored hash used outdated settings"""
+    if not hashed_password:
+        return False, None
+    return await password_pool.run(pwd_context.verify_and_update, password, hashed_password)
@@ -0,0 +1,65 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+
+
+class UserCache:
+    """
+    TTL + LRU cache of resolved users keyed by the token's user id.
+    invalidate() drops a user and remembers when, so tokens issued before a
+    disable/role change are not trusted on their claims alone.
+    """
+
+    def __init__(self, ttl_seconds: float = USER_CACHE_TTL_SECONDS, max_entries: int = USER_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._invalidated: "OrderedDict[int, float]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> Optional[Any]:
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(user_id, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, user_id: int, user: Any):
+        self._entries[user_id] = (time.monotonic() + self.ttl_seconds, user)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        self._entries.pop(user_id, None)
+        self._invalidated[user_id] = time.time()
+        self._invalidated.move_to_end(user_id)
+        while len(self._invalidated) > self.max_entries:
+            self._invalidated.popitem(last=False)
+
+    def invalidated_since(self, user_id: int, issued_at: float) -> bool:
+        """True when the user changed after a token issued at issued_at (unix time)"""
+        changed_at = self._invalidated.get(user_id)
+        return changed_at is not None and changed_at >= issued_at
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+user_cache = UserCache()
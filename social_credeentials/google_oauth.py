@@ -1,18 +1,25 @@
-from authlib.integrations.starlette_client import OAuth
+from functools import lru_cache
 # from starlette.requests import Request
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-oauth = OAuth()
 
-oauth.register(
-    name='google',
-    client_id=os.getenv("GOOGLE_CLIENT_ID"),
-    client_secret=os.getenv("GOOGLE_CLIENT_SECRET"),
-    server_metadata_url="https://accounts.google.com/.well-known/openid-configuration",
-    client_kwargs={
-        "scope": "openid email profile"
-    }
-)
+@lru_cache(maxsize=None)
+def get_oauth():
+    """Registered on first use instead of at import"""
+    from authlib.integrations.starlette_client import OAuth
+
+    oauth = OAuth()
+
+    oauth.register(
+        name='google',
+        client_id=os.getenv("GOOGLE_CLIENT_ID"),
+        client_secret=os.getenv("GOOGLE_CLIENT_SECRET"),
+        server_metadata_url="https://accounts.google.com/.well-known/openid-configuration",
+        client_kwargs={
+            "scope": "openid email profile"
+        }
+    )
+    return oauth
@@ -0,0 +1,154 @@
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+from dotenv import load_dotenv
+import gzip
+import hashlib
+import mimetypes
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+load_dotenv()
+
+STATIC_COMPRESS_MIN_BYTES = int(os.getenv("STATIC_COMPRESS_MIN_BYTES", "1024"))
+STATIC_BROTLI_QUALITY = int(os.getenv("STATIC_BROTLI_QUALITY", "11"))
+# Vite puts a content hash in every asset name, so they never change under the same url
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Unhashed files next to index.html
+ROOT_CACHE_CONTROL = "public, max-age=3600"
+# Always revalidated, the ETag makes that a 304
+INDEX_CACHE_CONTROL = "no-cache"
+
+COMPRESSIBLE_EXTENSIONS = {".js", ".mjs", ".css", ".html", ".svg", ".json", ".map", ".txt", ".xml", ".wasm"}
+
+
+def accepted_encodings(accept_encoding: str) -> set:
+    encodings = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        encodings.add(name.strip().lower())
+    return encodings
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def gzip_compress(body: bytes) -> bytes:
+    return gzip.compress(body, compresslevel=9, mtime=0)
+
+
+def brotli_compress(body: bytes) -> bytes:
+    return brotli.compress(body, quality=STATIC_BROTLI_QUALITY)
+
+
+# Preference order, brotli is in requirements, without the package only gzip is built
+COMPRESSORS = (("br", ".br", brotli_compress if brotli is not None else None), ("gzip", ".gz", gzip_compress))
+
+
+class CompressedAsset:
+    """A file held in memory with its gzip/brotli variants, built once at load"""
+
+    def __init__(self, path: str, body: bytes):
+        self.media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.digest = hashlib.sha1(body).hexdigest()[:20]
+        self.variants = {"identity": body}
+
+        # Precompressed siblings from the frontend build win over compressing here
+        for encoding, suffix, compress in COMPRESSORS:
+            if os.path.isfile(path + suffix):
+                with open(path + suffix, "rb") as f:
+                    self.variants[encoding] = f.read()
+            elif compress is not None and len(body) >= STATIC_COMPRESS_MIN_BYTES:
+                self.variants[encoding] = compress(body)
+
+        # Not worth sending a variant that didn't shrink
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and len(self.variants[encoding]) >= len(body):
+                del self.variants[encoding]
+
+    def response(self, scope: Scope, cache_control: str) -> Response:
+        request_headers = Headers(scope=scope)
+        accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+        encoding = next((name for name in ("br", "gzip") if name in self.variants and name in accepted), "identity")
+
+        headers = {"cache-control": cache_control, "etag": f'"{self.digest}-{encoding}"'}
+        if len(self.variants) > 1:
+            headers["vary"] = "Accept-Encoding"
+        if encoding != "identity":
+            headers["content-encoding"] = encoding
+
+        if etag_matches(request_headers.get("if-none-match", ""), headers["etag"]):
+            return Response(status_code=304, headers=headers)
+        return Response(self.variants[encoding], media_type=self.media_type, headers=headers)
+
+
+def load_compressed_assets(directory: str, recursive: bool = True) -> dict:
+    assets = {}
+    for root, dirs, files in os.walk(directory):
+        if not recursive:
+            dirs.clear()
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            with open(path, "rb") as f:
+                assets[os.path.relpath(path, directory).replace(os.sep, "/")] = CompressedAsset(path, f.read())
+    return assets
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    StaticFiles that serves text assets from memory, gzip/brotli negotiated on Accept-Encoding,
+    and stamps every response with the given Cache-Control. Other files (images) go through
+    the normal file response with its ETag/Last-Modified handling.
+    """
+
+    def __init__(self, *, directory: str, cache_control: str = IMMUTABLE_CACHE_CONTROL, recursive: bool = True, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.cache_control = cache_control
+        self.recursive = recursive
+        self.assets = None
+        self.top_level_files = {name for name in os.listdir(directory) if os.path.isfile(os.path.join(directory, name))}
+
+    def load(self):
+        """Reads and compresses the assets, the app lifespan calls it, get_response only as a fallback"""
+        if self.assets is None:
+            self.assets = load_compressed_assets(self.directory, self.recursive)
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        self.load()
+        asset = self.assets.get(path.replace(os.sep, "/"))
+        if asset is not None and scope["method"] in ("GET", "HEAD"):
+            return asset.response(scope, self.cache_control)
+
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            response.headers["cache-control"] = self.cache_control
+        return response
+
+
+class SPAIndex:
+    """index.html kept in memory, revalidated by ETag on every navigation"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.asset = None
+
+    def load(self):
+        if self.asset is None:
+            with open(self.path, "rb") as f:
+                self.asset = CompressedAsset(self.path, f.read())
+
+    def response(self, scope: Scope) -> Response:
+        self.load()
+        return self.asset.response(scope, INDEX_CACHE_CONTROL)
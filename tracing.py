@@ -0,0 +1,275 @@
+from collections import deque
+from contextvars import ContextVar
+from dotenv import load_dotenv
+from typing import Any, Callable, List, Optional
+import asyncio
+import functools
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+
+load_dotenv()
+
+# Spans are only recorded inside a sampled request, everywhere else span() hands back a no-op
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+# Head sampling, the share of requests that record spans at all
+TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", "1.0"))
+# Tail sampling, recorded traces faster than this are dropped unless they failed, 0 keeps all
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "0"))
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "2000"))
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "jsonl")
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+
+current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+def new_id(length: int) -> str:
+    return uuid.uuid4().hex[:length]
+
+
+class Trace:
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: List["Span"] = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def add(self, span: "Span"):
+        with self._lock:
+            if len(self.spans) >= TRACE_MAX_SPANS:
+                self.dropped += 1
+                return
+            self.spans.append(span)
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attributes", "start", "duration", "status", "error", "_started", "_token")
+
+    def __init__(self, trace: Trace, name: str, parent_id: Optional[str] = None, attributes: Optional[dict] = None):
+        self.trace = trace
+        self.span_id = new_id(16)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.start = 0.0
+        self.duration = 0.0
+        self.status = "ok"
+        self.error = ""
+        self._started = 0.0
+        self._token = None
+
+    @property
+    def trace_id(self) -> str:
+        return self.trace.trace_id
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self._token = current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._started
+        if exc_type is not None:
+            self.status = "cancelled" if issubclass(exc_type, asyncio.CancelledError) else "error"
+            self.error = f"{exc_type.__name__}: {exc}"
+        current_span.reset(self._token)
+        self.trace.add(self)
+        return False
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class NoopSpan:
+    trace_id = None
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class JsonlExporter:
+    """One span per line, appended to a local file"""
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[dict]):
+        lines = "".join(json.dumps(span, default=str) + "\n" for span in spans)
+        with self._lock, open(self.path, "a") as f:
+            f.write(lines)
+
+
+class InMemoryExporter:
+    """Keeps the last traces in memory, for tests and the benchmark"""
+
+    def __init__(self, max_traces: int = 1000):
+        self.traces = deque(maxlen=max_traces)
+
+    def export(self, spans: List[dict]):
+        self.traces.append(spans)
+
+    def spans(self) -> List[dict]:
+        return [span for trace in self.traces for span in trace]
+
+    def clear(self):
+        self.traces.clear()
+
+
+def build_exporter(kind: str = TRACE_EXPORTER):
+    if kind == "memory":
+        return InMemoryExporter()
+    if kind == "jsonl":
+        return JsonlExporter()
+    raise ValueError(f"Unknown TRACE_EXPORTER: {kind}")
+
+
+class Tracer:
+    """
+    Request-scoped spans kept in a contextvar, so asyncio tasks and LangGraph nodes started
+    inside a request nest under it. A request's spans are buffered until it finishes, then
+    the tail sampler decides whether the whole trace is exported.
+    """
+
+    def __init__(self, enabled: bool = TRACING_ENABLED, sample_ratio: float = TRACE_SAMPLE_RATIO, slow_ms: float = TRACE_SLOW_MS, exporter=None):
+        self.enabled = enabled
+        self.sample_ratio = sample_ratio
+        self.slow_ms = slow_ms
+        self.exporter = exporter if exporter is not None else (build_exporter() if enabled else None)
+        self.exported = 0
+        self.dropped = 0
+
+    def set_exporter(self, exporter):
+        self.exporter = exporter
+
+    def start_trace(self, name: str, trace_id: Optional[str] = None, parent_id: Optional[str] = None, sampled: Optional[bool] = None, **attributes) -> Optional[Span]:
+        """Root span of a request, None when head sampling skips it"""
+        if not self.enabled:
+            return None
+        if sampled is None:
+            sampled = random.random() < self.sample_ratio
+        if not sampled:
+            return None
+        return Span(Trace(trace_id or new_id(32)), name, parent_id, attributes)
+
+    def span(self, name: str, **attributes):
+        parent = current_span.get()
+        if parent is None:
+            return NOOP_SPAN
+        return Span(parent.trace, name, parent.span_id, attributes)
+
+    def current_trace_id(self) -> Optional[str]:
+        span = current_span.get()
+        return span.trace_id if span is not None else None
+
+    def keep(self, root: Span) -> bool:
+        if root.status != "ok" or root.attributes.get("http.status_code", 0) >= 500:
+            return True
+        return root.duration * 1000 >= self.slow_ms
+
+    async def finish(self, root: Span):
+        if not self.keep(root) or self.exporter is None:
+            self.dropped += 1
+            return
+        spans = [span.to_dict() for span in root.trace.spans]
+        if root.trace.dropped:
+            spans[-1]["attributes"]["dropped_spans"] = root.trace.dropped
+        self.exported += 1
+        await asyncio.to_thread(self.exporter.export, spans)
+
+    def traced(self, name: str):
+        """Wraps an async function in a span, left as is while tracing is off"""
+        def decorator(func: Callable):
+            if not self.enabled:
+                return func
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return await func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "exported": self.exported, "dropped": self.dropped}
+
+
+tracer = Tracer()
+traced = tracer.traced
+
+
+def parse_traceparent(value: str) -> tuple:
+    """W3C traceparent, returns (trace_id, parent_id, sampled) or Nones when it is not usable"""
+    parts = value.strip().lower().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or len(parts[3]) != 2:
+        return None, None, None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None, None, None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+class TracingMiddleware:
+    """Pure ASGI so streaming responses stay inside the root span until their last chunk"""
+
+    def __init__(self, app, tracer: Tracer = tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.tracer.enabled:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        trace_id, parent_id, sampled = parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        method = scope.get("method", "")
+        root = self.tracer.start_trace(f"{method} {scope.get('path', '')}", trace_id, parent_id, sampled, **{"http.method": method, "http.target": scope.get("path", "")})
+        if root is None:
+            return await self.app(scope, receive, send)
+
+        async def send_with_trace_id(message):
+            if message["type"] == "http.response.start":
+                root.set_attribute("http.status_code", message["status"])
+                message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", root.trace_id.encode())]
+            await send(message)
+
+        try:
+            with root:
+                await self.app(scope, receive, send_with_trace_id)
+        finally:
+            # Named after the route template once routing ran, raw paths would make every trace unique
+            route = scope.get("route")
+            if route is not None and getattr(route, "path", None):
+                root.name = f"{method} {route.path}"
+            await self.tracer.finish(root)
@@ -1,16 +1,21 @@
 from fastapi import HTTPException
-from clerk_backend_api import Clerk, AuthenticateRequestOptions
+from functools import lru_cache
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
-clerk_sdk = Clerk(bearer_auth=os.getenv("CLERK_SECRET_KEY"))
+@lru_cache(maxsize=None)
+def get_clerk_sdk():
+    # The sdk takes most of a second to import, only pay for it when Clerk auth is used
+    from clerk_backend_api import Clerk
+    return Clerk(bearer_auth=os.getenv("CLERK_SECRET_KEY"))
 
 def authenticate_and_get_user_details(request):
+    from clerk_backend_api import AuthenticateRequestOptions
     try:
-        request_state = clerk_sdk.authenticate_request(
+        request_state = get_clerk_sdk().authenticate_request(
             request,
             AuthenticateRequestOptions(
                 authorized_parties=["http://localhost:5173", "http://localhost:5174"],